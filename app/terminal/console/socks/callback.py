@@ -40,7 +40,7 @@ class CallbackChangePortFlag:
     def execute(self) -> None:
         self.flag.port = self.port.value
         self.flag_list.set(self.flag)
-        self.socks_manager.restart()
+        self.socks_manager.reload()
 
     def __call__(self) -> None:
         print(color_name.GREEN + 'Porta atual: {}'.format(self.flag.port) + color_name.END)
@@ -1,5 +1,6 @@
 import os
 import re
+import socket
 import typing as t
 from scripts import CERT_PATH, SOCKS_PATH
 
@@ -65,7 +66,7 @@ class Screen:
         self.command = command
 
     def is_running(self) -> bool:
-        return self.screen_name in os.popen('screen -ls').read()
+        return self.screen_name in Screen.all()
 
     def execute(self) -> None:
         if not self.is_running():
@@ -79,6 +80,11 @@ class Screen:
         self.kill()
         self.execute()
 
+    def rename(self, screen_name: str) -> None:
+        if self.is_running():
+            os.system('screen -S {} -X sessionname {}'.format(self.screen_name, screen_name))
+            self.screen_name = screen_name
+
     def __repr__(self):
         return 'Screen({})'.format(self.screen_name)
 
@@ -88,8 +94,21 @@ class Screen:
         return re.findall(r'\d+\.(.*)\t', os.popen(cmd).read())
 
 
+def send_control(path: str, command: str, timeout: float = 5) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(command.encode() + b'\n')
+            return sock.recv(1024).startswith(b'OK')
+    except OSError:
+        return False
+
+
 class SocksManager:
     _screen_name = 'socks:{mode}:{port}'
+    _control_path = '/tmp/socks-{mode}-{port}.sock'
+    _remotes_path = os.path.join(os.path.expanduser('~'), '.socks-{mode}-{port}')
 
     def __init__(
         self,
@@ -100,6 +119,15 @@ class SocksManager:
         self.port = port
         self.flag_list = flag_list
         self.mode = mode.lower()
+        self.load_remotes()
+
+    @property
+    def control_path(self) -> str:
+        return self._control_path.format(mode=self.mode, port=self.port)
+
+    @property
+    def remotes_path(self) -> str:
+        return self._remotes_path.format(mode=self.mode, port=self.port)
 
     @property
     def command(self) -> str:
@@ -108,6 +136,10 @@ class SocksManager:
             port=self.port,
             flags=self.flag_list,
         )
+        cmd += ' --remotes {remotes_path} --control {control_path}'.format(
+            remotes_path=self.remotes_path,
+            control_path=self.control_path,
+        )
         if self.mode == 'https':
             cmd += ' --cert {cert_path}'.format(cert_path=CERT_PATH)
             cmd += ' --{mode}'.format(mode=self.mode)
@@ -123,17 +155,52 @@ class SocksManager:
             self.command,
         )
 
+    def load_remotes(self) -> None:
+        if not os.path.exists(self.remotes_path):
+            return
+
+        with open(self.remotes_path) as f:
+            for line in f:
+                name, port = line.split()
+                flag = self.flag_list._flag_map.get(name.upper())
+                if flag is not None:
+                    flag.port = int(port)
+
+    def save_remotes(self) -> None:
+        with open(self.remotes_path, 'w') as f:
+            for flag in self.flag_list._flag_map.values():
+                f.write('{name} {port}\n'.format(name=flag._flag.lower(), port=flag.port))
+
     def is_running(self) -> bool:
         return self.screen.is_running()
 
     def start(self) -> None:
+        self.save_remotes()
         self.screen.execute()
 
     def stop(self) -> None:
-        self.screen.kill()
+        screen = self.screen
+        Screen('draining:' + screen.screen_name, '').kill()
+        screen.kill()
+
+    def reload(self) -> None:
+        self.save_remotes()
+        if not send_control(self.control_path, 'reload'):
+            self.restart()
 
     def restart(self) -> None:
-        self.screen.restart()
+        screen = self.screen
+        if not screen.is_running() or not os.path.exists(self.control_path):
+            screen.restart()
+            return
+
+        self.save_remotes()
+        screen_name = screen.screen_name
+        screen.rename('draining:' + screen_name)
+        Screen(
+            screen_name,
+            self.command + ' --takeover {}'.format(self.control_path),
+        ).execute()
 
     @staticmethod
     def get_running_port(mode: str = 'http') -> int:
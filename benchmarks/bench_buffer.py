@@ -0,0 +1,104 @@
+"""Micro-benchmark: pending-buffer copies for a large download over a slow reader.
+
+Compares the old ``bytes`` concatenation buffer with the chunked
+``Connection`` buffer from ``scripts/socks.py``. The writer queues
+``--chunk`` bytes and flushes once per step while the reader only drains
+``--chunk / --ratio`` bytes, so the pending buffer keeps growing.
+
+    python3 benchmarks/bench_buffer.py --size 8388608 --chunk 8192 --ratio 4
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts.socks import Connection  # noqa: E402
+
+
+class LegacyConnection(Connection):
+    def __init__(self, conn, addr):
+        super().__init__(conn, addr)
+        self.legacy_buffer = b''
+        self.copied = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self.legacy_buffer)
+
+    def queue(self, data):
+        self.legacy_buffer += data
+        self.copied += len(self.legacy_buffer)
+        return len(data)
+
+    def flush(self):
+        sent = self.write(self.legacy_buffer)
+        self.legacy_buffer = self.legacy_buffer[sent:]
+        self.copied += len(self.legacy_buffer)
+        return sent
+
+
+def run(connection_class, size: int, chunk: int, ratio: int) -> dict:
+    writer, reader = socket.socketpair()
+    writer.setblocking(False)
+    reader.setblocking(False)
+
+    connection = connection_class(writer, ('127.0.0.1', 0))
+    payload = os.urandom(chunk)
+    received = 0
+
+    def drain(limit: int) -> int:
+        try:
+            return len(reader.recv(limit))
+        except BlockingIOError:
+            return 0
+
+    def flush() -> None:
+        try:
+            connection.flush()
+        except BlockingIOError:
+            pass
+
+    start = time.perf_counter()
+
+    for _ in range(size // chunk):
+        connection.queue(payload)
+        flush()
+        received += drain(max(chunk // ratio, 1))
+
+    while connection.pending:
+        flush()
+        received += drain(1 << 20)
+
+    while received < size:
+        received += drain(1 << 20)
+
+    elapsed = time.perf_counter() - start
+
+    writer.close()
+    reader.close()
+
+    return {
+        'buffer': connection_class.__name__,
+        'bytes': size,
+        'seconds': round(elapsed, 4),
+        'copied_bytes': getattr(connection, 'copied', 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Connection buffer benchmark')
+    parser.add_argument('--size', type=int, default=8 * 1024 * 1024, help='Download size')
+    parser.add_argument('--chunk', type=int, default=8192, help='Read size')
+    parser.add_argument('--ratio', type=int, default=4, help='Writer/reader speed ratio')
+    args = parser.parse_args()
+
+    for connection_class in (LegacyConnection, Connection):
+        print(json.dumps(run(connection_class, args.size, args.chunk, args.ratio)))
+
+
+if __name__ == '__main__':
+    main()
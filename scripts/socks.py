@@ -1,20 +1,30 @@
+import array
+import asyncio
+import bisect
+import collections
+import itertools
+import json
+import math
 import socket
 import ssl
 import select
 import threading
 import os
 import argparse
+import errno
 import logging
 import resource
+import signal
+import sys
+import termios
+import time
 
 from abc import abstractproperty, ABCMeta, abstractmethod
-from typing import List, Tuple, Union, Optional
+from typing import Callable, Deque, Dict, List, Set, Tuple, TypeVar, Union, Optional
 
 __author__ = 'Glemison C. Dutra'
 __version__ = '1.1.1'
 
-resource.setrlimit(resource.RLIMIT_NOFILE, (65536, 65536))
-
 logger = logging.getLogger(__name__)
 
 WS_DEFAULT_RESPONSE = b'\r\n'.join(
@@ -39,6 +49,251 @@ REMOTES_ADDRESS = {
 }
 
 
+Labels = Tuple[str, ...]
+
+
+class Metric:
+    type = 'unknown'
+
+    def __init__(self, name: str, description: str, labels: Labels = ()) -> None:
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.__local = threading.local()
+        self.__shards: List[Tuple[threading.Thread, dict]] = []
+        self.__retired: dict = {}
+        self.__lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self.__local.shard
+        except AttributeError:
+            pass
+
+        shard: dict = {}
+        with self.__lock:
+            if len(self.__shards) > 2 * max(threading.active_count(), 8):
+                self._retire()
+            self.__shards.append((threading.current_thread(), shard))
+
+        self.__local.shard = shard
+        return shard
+
+    def _merge(self, target: dict, values: dict) -> None:
+        for labels, value in values.items():
+            target[labels] = target.get(labels, 0) + value
+
+    def _retire(self) -> None:
+        alive = []
+        for thread, shard in self.__shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                self._merge(self.__retired, shard)
+        self.__shards = alive
+
+    def collect(self) -> dict:
+        with self.__lock:
+            self._retire()
+            values = dict(self.__retired)
+            for _, shard in self.__shards:
+                self._merge(values, dict(shard))
+        return values
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, labels: Labels = ()) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def value(self, labels: Labels = ()) -> float:
+        return self.collect().get(labels, 0)
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, amount: float = 1, labels: Labels = ()) -> None:
+        self.inc(-amount, labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, target: dict, values: dict) -> None:
+        for labels, counts in values.items():
+            merged = target.setdefault(labels, [0] * (len(self.buckets) + 2))
+            for index, count in enumerate(counts):
+                merged[index] += count
+
+    def count(self, labels: Labels = ()) -> int:
+        return sum(self.collect().get(labels, [0])[:-1])
+
+
+MetricType = TypeVar('MetricType', bound=Metric)
+
+
+class MetricsRegistry:
+    content_type = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+    def __init__(self) -> None:
+        self.__metrics: List[Metric] = []
+
+    def register(self, metric: MetricType) -> MetricType:
+        self.__metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> List[list]:
+        return [
+            [metric.name, [[list(labels), value] for labels, value in metric.collect().items()]]
+            for metric in self.__metrics
+        ]
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def _format_labels(self, names: Labels, values: Labels, extra: str = '') -> str:
+        pairs = ['%s="%s"' % (name, self._escape(value)) for name, value in zip(names, values)]
+        if extra:
+            pairs.append(extra)
+        return '{%s}' % ','.join(pairs) if pairs else ''
+
+    def render(self, snapshots: List[List[list]]) -> str:
+        metrics = {metric.name: metric for metric in self.__metrics}
+        merged: Dict[str, dict] = {name: {} for name in metrics}
+
+        for snapshot in snapshots:
+            for name, samples in snapshot:
+                if name in metrics:
+                    metrics[name]._merge(
+                        merged[name],
+                        {tuple(labels): value for labels, value in samples},
+                    )
+
+        lines = []
+        for metric in self.__metrics:
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines.append('# HELP %s %s' % (metric.name, metric.description))
+
+            for labels, value in sorted(merged[metric.name].items()):
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    bounds = [repr(bucket) for bucket in metric.buckets] + ['+Inf']
+                    for bound, count in zip(bounds, value):
+                        cumulative += count
+                        lines.append(
+                            '%s_bucket%s %d'
+                            % (
+                                metric.name,
+                                self._format_labels(metric.labels, labels, 'le="%s"' % bound),
+                                cumulative,
+                            )
+                        )
+                    label_text = self._format_labels(metric.labels, labels)
+                    lines.append('%s_count%s %d' % (metric.name, label_text, cumulative))
+                    lines.append('%s_sum%s %s' % (metric.name, label_text, repr(float(value[-1]))))
+                else:
+                    suffix = '_total' if metric.type == 'counter' else ''
+                    lines.append(
+                        '%s%s%s %s'
+                        % (metric.name, suffix, self._format_labels(metric.labels, labels), value)
+                    )
+
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+ACCEPTED_CONNECTIONS = REGISTRY.register(
+    Counter(
+        'socks_accepted_connections',
+        'Accepted client connections',
+    )
+)
+
+ACTIVE_CONNECTIONS = REGISTRY.register(
+    Gauge(
+        'socks_active_connections',
+        'Client connections relayed to a backend',
+        ('backend',),
+    )
+)
+
+TRANSFERRED_BYTES = REGISTRY.register(
+    Counter(
+        'socks_transferred_bytes',
+        'Bytes received from (in) and sent to (out) clients',
+        ('direction',),
+    )
+)
+
+REJECTED_CONNECTIONS = REGISTRY.register(
+    Counter(
+        'socks_rejected_connections',
+        'Connections rejected by admission control',
+        ('reason',),
+    )
+)
+
+DETECTION_FAILURES = REGISTRY.register(
+    Counter(
+        'socks_detection_failures',
+        'Client connections closed before a backend was detected',
+    )
+)
+
+BACKEND_CONNECT_SECONDS = REGISTRY.register(
+    Histogram(
+        'socks_backend_connect_seconds',
+        'Time spent connecting to the backend',
+        ('backend',),
+    )
+)
+
+SHAPED_BYTES = REGISTRY.register(
+    Counter(
+        'socks_shaped_bytes',
+        'Bytes relayed through a bandwidth limit, by direction',
+        ('direction',),
+    )
+)
+
+THROTTLED_CONNECTIONS = REGISTRY.register(
+    Gauge(
+        'socks_throttled_connections',
+        'Connections with a paused read side because the peer buffer is full',
+    )
+)
+
+HANDSHAKE_QUEUE = REGISTRY.register(
+    Gauge(
+        'socks_tls_handshake_queue',
+        'Accepted TLS connections waiting for a handshake worker',
+    )
+)
+
+HANDSHAKE_SECONDS = REGISTRY.register(
+    Histogram(
+        'socks_tls_handshake_seconds',
+        'Time spent in the TLS handshake',
+    )
+)
+
+
 class ResponseParser(metaclass=ABCMeta):
     @abstractmethod
     def parse(self, data: bytes) -> bytes:
@@ -71,17 +326,21 @@ class HttpParseResponse(ResponseParserAbstract):
 
 
 class ConnectionTypeParser:
-    def __init__(self, type: bytes, address: Tuple[str, int]):
+    def __init__(self, type: bytes, remote: str):
         self._type = type
-        self._address = address
+        self._remote = remote
 
     @property
     def type(self) -> bytes:
         return self._type
 
+    @property
+    def remote(self) -> str:
+        return self._remote
+
     @property
     def address(self) -> Tuple[str, int]:
-        return self._address
+        return REMOTES_ADDRESS[self._remote]
 
     @abstractproperty
     def name(self) -> str:
@@ -93,7 +352,7 @@ class ConnectionTypeParser:
 
 class SSHConnectionType(ConnectionTypeParser):
     def __init__(self) -> None:
-        super().__init__(b'SSH-', REMOTES_ADDRESS['ssh'])
+        super().__init__(b'SSH-', 'ssh')
 
     @property
     def name(self) -> str:
@@ -102,7 +361,7 @@ class SSHConnectionType(ConnectionTypeParser):
 
 class OpenVPNConnectionType(ConnectionTypeParser):
     def __init__(self) -> None:
-        super().__init__(b'\x0068', REMOTES_ADDRESS['openvpn'])
+        super().__init__(b'\x0068', 'openvpn')
 
     @property
     def name(self) -> str:
@@ -111,33 +370,154 @@ class OpenVPNConnectionType(ConnectionTypeParser):
 
 class V2RayConnectionType(ConnectionTypeParser):
     def __init__(self) -> None:
-        super().__init__(b'\x00', REMOTES_ADDRESS['v2ray'])
+        super().__init__(b'\x00', 'v2ray')
 
     @property
     def name(self) -> str:
         return 'V2Ray'
 
 
+class PrefixConnectionType(ConnectionTypeParser):
+    def __init__(self, name: str, type: bytes, remote: str) -> None:
+        super().__init__(type, remote)
+        self._name = name
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+
+class Remotes:
+    path: Optional[str] = None
+    host = '0.0.0.0'
+
+    @staticmethod
+    def parse(path: str, host: str = '0.0.0.0') -> Dict[str, Tuple[str, int]]:
+        remotes: Dict[str, Tuple[str, int]] = {}
+
+        with open(path) as f:
+            for number, line in enumerate(f, 1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+
+                try:
+                    name, address = line.split()
+                    remote_host, _, port = address.rpartition(':')
+                    remotes[name.lower()] = (remote_host or host, int(port))
+                except ValueError:
+                    raise ValueError('%s:%d: expected "<name> [host:]port"' % (path, number))
+
+        return remotes
+
+    @classmethod
+    def reload(cls) -> bool:
+        if cls.path is None:
+            return False
+
+        try:
+            remotes = cls.parse(cls.path, cls.host)
+        except (OSError, ValueError) as e:
+            logger.error('Erro ao recarregar destinos: %s' % e)
+            return False
+
+        REMOTES_ADDRESS.update(remotes)
+        logger.info(
+            'Destinos recarregados: %s'
+            % ', '.join('%s=%s:%d' % (name, *address) for name, address in remotes.items())
+        )
+        return True
+
+
+class ProtocolTable:
+    def __init__(self, types: List[ConnectionTypeParser]) -> None:
+        self.__types = list(types)
+        self.__table: Dict[int, List[ConnectionTypeParser]] = {}
+
+        for _type in sorted(self.__types, key=lambda t: len(t.type), reverse=True):
+            if not _type.type:
+                raise ValueError('Empty prefix for %s' % _type.name)
+            self.__table.setdefault(_type.type[0], []).append(_type)
+
+    @property
+    def types(self) -> List[ConnectionTypeParser]:
+        return list(self.__types)
+
+    def match(self, data: bytes) -> Tuple[Optional[ConnectionTypeParser], bool]:
+        if not data:
+            return None, False
+
+        candidates = self.__table.get(data[0], [])
+        waiting = False
+
+        for _type in candidates:
+            if data.startswith(_type.type):
+                return _type, not waiting
+
+            if _type.type.startswith(data):
+                waiting = True
+
+        return None, not waiting
+
+    @classmethod
+    def load(cls, path: str) -> 'ProtocolTable':
+        types: List[ConnectionTypeParser] = []
+
+        with open(path) as f:
+            for number, line in enumerate(f, 1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+
+                try:
+                    name, remote, prefix = line.split(None, 2)
+                except ValueError:
+                    raise ValueError('%s:%d: expected "<name> <remote> <prefix>"' % (path, number))
+
+                if remote not in REMOTES_ADDRESS:
+                    raise ValueError('%s:%d: unknown remote %s' % (path, number, remote))
+
+                raw = prefix.encode('latin-1').decode('unicode_escape').encode('latin-1')
+                types.append(PrefixConnectionType(name, raw, remote))
+
+        return cls(types)
+
+
 class ConnectionTypeFactory:
     _types = [
         SSHConnectionType(),
         OpenVPNConnectionType(),
         V2RayConnectionType(),
     ]
+    table = ProtocolTable(_types)
 
     @staticmethod
     def get_type(data: bytes) -> Union[ConnectionTypeParser, None]:
-        for _type in ConnectionTypeFactory._types:
-            if _type.is_valid(data):
-                return _type
-        return None
+        return ConnectionTypeFactory.table.match(data)[0]
+
+
+class ProtocolSniffer:
+    size = 4096
+    timeout = 0.5
+
+    @staticmethod
+    def split_request(data: bytes) -> int:
+        end = data.find(b'\r\n\r\n')
+        return end + 4 if end >= 0 else len(data)
 
 
 class Connection:
+    read_size = 8192
+    max_iov = min(os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 16, 64)
+
+    __read_buffers = threading.local()
+
     def __init__(self, conn: Union[socket.socket, ssl.SSLSocket], addr: Tuple[str, int]):
         self.__conn = conn
         self.__addr = addr
-        self.__buffer = b''
+        self.__chunks: Deque[Union[bytes, memoryview]] = collections.deque()
+        self.__pending = 0
+        self.__unread = b''
         self.__closed = False
 
     @property
@@ -170,11 +550,19 @@ class Connection:
 
     @property
     def buffer(self) -> bytes:
-        return self.__buffer
+        return b''.join(self.__chunks)
 
     @buffer.setter
     def buffer(self, data: bytes) -> None:
-        self.__buffer = data
+        self.__chunks.clear()
+        self.__pending = 0
+        if data:
+            self.__chunks.append(data)
+            self.__pending = len(data)
+
+    @property
+    def pending(self) -> int:
+        return self.__pending
 
     @property
     def closed(self) -> bool:
@@ -188,9 +576,62 @@ class Connection:
         self.conn.close()
         self.closed = True
 
-    def read(self, size: int = 4096) -> Optional[bytes]:
-        data = self.conn.recv(size)
-        return data if len(data) > 0 else None
+    def shutdown(self) -> None:
+        try:
+            socket.socket.shutdown(self.__conn, socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _get_read_buffer(self) -> bytearray:
+        buffer = getattr(self.__read_buffers, 'buffer', None)
+        if buffer is None or len(buffer) < self.read_size:
+            buffer = self.__read_buffers.buffer = bytearray(self.read_size)
+        return buffer
+
+    @property
+    def unread(self) -> int:
+        return len(self.__unread)
+
+    def peek(self, size: int) -> Optional[bytes]:
+        conn = self.conn
+
+        if not isinstance(conn, ssl.SSLSocket):
+            data = conn.recv(size, socket.MSG_PEEK)
+            return data if len(data) > 0 else None
+
+        if len(self.__unread) < size:
+            readable = not self.__unread or conn.pending() > 0
+            if not readable:
+                readable = bool(select.select([conn], [], [], 0)[0])
+
+            if readable:
+                data = conn.recv(size - len(self.__unread))
+                if not data:
+                    return None
+                self.__unread += data
+
+        return self.__unread[:size]
+
+    def consume(self, size: int) -> bytes:
+        if self.__unread:
+            data, self.__unread = self.__unread[:size], self.__unread[size:]
+            return data
+
+        data = b''
+        while len(data) < size:
+            chunk = self.conn.recv(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def read(self, size: Optional[int] = None) -> Optional[bytes]:
+        if self.__unread:
+            return self.consume(size or self.read_size)
+
+        view = memoryview(self._get_read_buffer())[: size or self.read_size]
+        received = self.conn.recv_into(view)
+        return bytes(view[:received]) if received > 0 else None
 
     def write(self, data: Union[bytes, str]) -> int:
         if isinstance(data, str):
@@ -208,12 +649,33 @@ class Connection:
         if len(data) <= 0:
             raise ValueError('Queue data is empty')
 
-        self.__buffer += data
+        self.__chunks.append(data)
+        self.__pending += len(data)
         return len(data)
 
+    def _send_chunks(self) -> int:
+        conn = self.conn
+        if len(self.__chunks) > 1 and not isinstance(conn, ssl.SSLSocket):
+            return conn.sendmsg(list(itertools.islice(self.__chunks, self.max_iov)))
+        return self.write(self.__chunks[0])
+
     def flush(self) -> int:
-        sent = self.write(self.__buffer)
-        self.__buffer = self.__buffer[sent:]
+        if not self.__chunks:
+            return 0
+
+        sent = self._send_chunks()
+        self.__pending -= sent
+
+        remaining = sent
+        while remaining > 0:
+            chunk = self.__chunks[0]
+            if len(chunk) > remaining:
+                self.__chunks[0] = memoryview(chunk)[remaining:]
+                break
+
+            self.__chunks.popleft()
+            remaining -= len(chunk)
+
         return sent
 
 
@@ -238,12 +700,381 @@ class Server(Connection):
         logger.debug('%s Conexão estabelecida' % self)
 
 
+class Timer:
+    def __init__(self, expires: int, callback: Callable[[], None]) -> None:
+        self.expires = expires
+        self.callback = callback
+
+
+class TimerWheel(threading.Thread):
+    tick = 1.0
+    size = 512
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.daemon = True
+        self.__slots: List[Dict[int, Timer]] = [{} for _ in range(self.size)]
+        self.__lock = threading.Lock()
+        self.__ticks = 0
+        self.__started = False
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> Timer:
+        with self.__lock:
+            if not self.__started:
+                self.__started = True
+                self.start()
+
+            timer = Timer(self.__ticks + max(1, math.ceil(delay / self.tick)), callback)
+            self.__slots[timer.expires % self.size][id(timer)] = timer
+
+        return timer
+
+    def cancel(self, timer: Timer) -> None:
+        with self.__lock:
+            self.__slots[timer.expires % self.size].pop(id(timer), None)
+
+    def _advance(self) -> List[Timer]:
+        with self.__lock:
+            self.__ticks += 1
+            slot = self.__slots[self.__ticks % self.size]
+            expired = [timer for timer in slot.values() if timer.expires <= self.__ticks]
+            for timer in expired:
+                del slot[id(timer)]
+
+        return expired
+
+    def run(self) -> None:
+        next_tick = time.monotonic() + self.tick
+
+        while True:
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+            next_tick += self.tick
+
+            expired = self._advance()
+            for timer in expired:
+                try:
+                    timer.callback()
+                except Exception as e:
+                    logger.exception('Erro no temporizador: %s' % e)
+
+            if expired:
+                logger.debug('%d temporizadores expirados' % len(expired))
+
+
+TIMERS = TimerWheel()
+
+
+class SessionTimers:
+    detect_timeout = 60.0
+    idle_timeout = 900.0
+    max_age = 0.0
+
+    def __init__(self, expire: Callable[[str], None], wheel: Optional[TimerWheel] = None) -> None:
+        self.__expire = expire
+        self.__wheel = wheel or TIMERS
+        self.__timers: Dict[str, Timer] = {}
+        self.__cancelled = False
+        self.last_activity = time.monotonic()
+
+    def _schedule(self, name: str, delay: float, callback: Callable[[], None]) -> None:
+        if not self.__cancelled:
+            self.__timers[name] = self.__wheel.schedule(delay, callback)
+
+    def start(self) -> None:
+        if self.detect_timeout > 0:
+            self._schedule('detect', self.detect_timeout, lambda: self.__expire('detecção'))
+        if self.idle_timeout > 0:
+            self._schedule('idle', self.idle_timeout, self._check_idle)
+        if self.max_age > 0:
+            self._schedule('age', self.max_age, lambda: self.__expire('duração máxima'))
+
+    def touch(self) -> None:
+        self.last_activity = time.monotonic()
+
+    def detected(self) -> None:
+        timer = self.__timers.pop('detect', None)
+        if timer is not None:
+            self.__wheel.cancel(timer)
+
+    def _check_idle(self) -> None:
+        idle = time.monotonic() - self.last_activity
+        if idle >= self.idle_timeout:
+            self.__expire('inatividade')
+        else:
+            self._schedule('idle', self.idle_timeout - idle, self._check_idle)
+
+    def cancel(self) -> None:
+        self.__cancelled = True
+        for timer in list(self.__timers.values()):
+            self.__wheel.cancel(timer)
+        self.__timers.clear()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount: float = 1) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens < amount:
+            return False
+
+        self.tokens -= amount
+        return True
+
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+    def available(self) -> float:
+        self._refill(time.monotonic())
+        return self.tokens
+
+    def take(self, amount: float) -> None:
+        self._refill(time.monotonic())
+        self.tokens -= amount
+
+    def delay(self, amount: float = 1) -> float:
+        return max(amount - self.available(), 0) / self.rate
+
+
+class SharedTokenBucket(TokenBucket):
+    def __init__(self, rate: float, burst: float) -> None:
+        super().__init__(rate, burst)
+        self.__lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        with self.__lock:
+            super()._refill(now)
+
+    def take(self, amount: float) -> None:
+        with self.__lock:
+            super()._refill(time.monotonic())
+            self.tokens -= amount
+
+
+class BandwidthLimit:
+    def __init__(self, buckets: List[TokenBucket], direction: str) -> None:
+        self.buckets = buckets
+        self.direction = direction
+
+    def allowance(self, size: int) -> int:
+        return max(min([size] + [int(bucket.available()) for bucket in self.buckets]), 0)
+
+    def charge(self, amount: int) -> None:
+        for bucket in self.buckets:
+            bucket.take(amount)
+        SHAPED_BYTES.inc(amount, (self.direction,))
+
+    def delay(self) -> float:
+        return max(bucket.delay() for bucket in self.buckets)
+
+
+class BandwidthShaper:
+    upload_rate = 0
+    download_rate = 0
+    ip_upload_rate = 0
+    ip_download_rate = 0
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__per_ip: Dict[str, list] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return any(
+            (self.upload_rate, self.download_rate, self.ip_upload_rate, self.ip_download_rate)
+        )
+
+    @staticmethod
+    def _limit(
+        rate: int, shared: Optional[TokenBucket], direction: str
+    ) -> Optional[BandwidthLimit]:
+        buckets = [TokenBucket(rate, rate)] if rate > 0 else []
+        if shared is not None:
+            buckets.append(shared)
+        return BandwidthLimit(buckets, direction) if buckets else None
+
+    def acquire(self, ip: str) -> Tuple[Optional[BandwidthLimit], Optional[BandwidthLimit]]:
+        if not self.enabled:
+            return None, None
+
+        shared: List[Optional[TokenBucket]] = [None, None]
+        if self.ip_upload_rate > 0 or self.ip_download_rate > 0:
+            with self.__lock:
+                entry = self.__per_ip.get(ip)
+                if entry is None:
+                    entry = self.__per_ip[ip] = [
+                        0,
+                        SharedTokenBucket(self.ip_upload_rate, self.ip_upload_rate)
+                        if self.ip_upload_rate > 0
+                        else None,
+                        SharedTokenBucket(self.ip_download_rate, self.ip_download_rate)
+                        if self.ip_download_rate > 0
+                        else None,
+                    ]
+                entry[0] += 1
+                shared = entry[1:]
+
+        return (
+            self._limit(self.upload_rate, shared[0], 'in'),
+            self._limit(self.download_rate, shared[1], 'out'),
+        )
+
+    def release(self, ip: str) -> None:
+        with self.__lock:
+            entry = self.__per_ip.get(ip)
+            if entry is None:
+                return
+
+            entry[0] -= 1
+            if entry[0] <= 0:
+                del self.__per_ip[ip]
+
+
+SHAPER = BandwidthShaper()
+
+
+class SplicePipe:
+    size = 65536
+    flags = getattr(os, 'SPLICE_F_MOVE', 0) | getattr(os, 'SPLICE_F_NONBLOCK', 0)
+
+    def __init__(
+        self,
+        src: socket.socket,
+        dst: socket.socket,
+        touch: Optional[Callable[[], None]] = None,
+        limit: Optional[BandwidthLimit] = None,
+    ) -> None:
+        self.src = src
+        self.dst = dst
+        self.touch = touch
+        self.limit = limit
+        self.pending = 0
+        self.transferred = 0
+        self.eof = False
+        self.__read_fd, self.__write_fd = os.pipe()
+
+    @property
+    def finished(self) -> bool:
+        return self.eof and not self.pending
+
+    @property
+    def idle(self) -> bool:
+        return not self.pending and not self.eof
+
+    @property
+    def throttled(self) -> bool:
+        return self.limit is not None and self.idle and self.limit.allowance(1) == 0
+
+    def fill(self) -> None:
+        size = self.size if self.limit is None else self.limit.allowance(self.size)
+
+        try:
+            filled = os.splice(self.src.fileno(), self.__write_fd, size, flags=self.flags)
+        except BlockingIOError:
+            return
+
+        if filled == 0:
+            self.eof = True
+        else:
+            if self.limit is not None:
+                self.limit.charge(filled)
+            if self.touch is not None:
+                self.touch()
+        self.pending += filled
+
+    def drain(self) -> None:
+        try:
+            drained = os.splice(self.__read_fd, self.dst.fileno(), self.pending, flags=self.flags)
+        except BlockingIOError:
+            return
+
+        self.pending -= drained
+        self.transferred += drained
+
+    def close(self) -> None:
+        os.close(self.__read_fd)
+        os.close(self.__write_fd)
+
+
+class SpliceRelay:
+    def __init__(
+        self,
+        first: socket.socket,
+        second: socket.socket,
+        touch: Optional[Callable[[], None]] = None,
+        limits: Tuple[Optional[BandwidthLimit], Optional[BandwidthLimit]] = (None, None),
+    ) -> None:
+        self.__first = first
+        self.__second = second
+        self.__touch = touch
+        self.__limits = limits
+        self.__transferred = (0, 0)
+
+    @property
+    def transferred(self) -> Tuple[int, int]:
+        return self.__transferred
+
+    @staticmethod
+    def is_supported(*conns: Union[socket.socket, ssl.SSLSocket]) -> bool:
+        if not hasattr(os, 'splice'):
+            return False
+        return all(not isinstance(conn, ssl.SSLSocket) for conn in conns)
+
+    def relay(self) -> None:
+        pipes = [
+            SplicePipe(self.__first, self.__second, self.__touch, self.__limits[0]),
+            SplicePipe(self.__second, self.__first, self.__touch, self.__limits[1]),
+        ]
+
+        self.__first.setblocking(False)
+        self.__second.setblocking(False)
+
+        try:
+            while not any(pipe.finished for pipe in pipes):
+                throttled = [pipe for pipe in pipes if pipe.throttled]
+                rlist = [pipe.src for pipe in pipes if pipe.idle and pipe not in throttled]
+                wlist = [pipe.dst for pipe in pipes if pipe.pending]
+                delays = [pipe.limit.delay() for pipe in throttled]
+
+                r, w, _ = select.select(rlist, wlist, [], min(delays) if delays else None)
+
+                for pipe in pipes:
+                    if pipe.src in r:
+                        pipe.fill()
+
+                    if pipe.pending:
+                        pipe.drain()
+        finally:
+            self.__transferred = (pipes[0].transferred, pipes[1].transferred)
+            for pipe in pipes:
+                pipe.close()
+
+
 class Proxy(threading.Thread):
+    use_splice = True
+    high_water = 1024 * 1024
+    low_water = 256 * 1024
+
     def __init__(self, client: Client, server: Optional[Server] = None) -> None:
         super().__init__()
         self.client = client
         self.server = server
         self.__running = False
+        self.__paused: Set[Connection] = set()
+        self.__sniff_deadline: Optional[float] = None
+        self.__backend: Optional[str] = None
+        self.__limits: Tuple[Optional[BandwidthLimit], Optional[BandwidthLimit]] = (None, None)
+        self.__wake: Optional[float] = None
+        self.__timers = SessionTimers(self.expire)
         self.__http_response_parser = WebsocketParseResponse(HttpParseResponse())
 
     @property
@@ -256,41 +1087,133 @@ class Proxy(threading.Thread):
     def running(self, value: bool) -> None:
         self.__running = value
 
-    def _process_request(self, data: bytes) -> None:
-        if self.server and not self.server.closed:
-            self.server.queue(data)
+    def _connect(self, connection_type: ConnectionTypeParser) -> None:
+        logger.info(
+            '%s -> Modo %s - %s:%s',
+            self.client,
+            connection_type.name,
+            *connection_type.address,
+        )
+        start = time.monotonic()
+        self.server = Server.of(connection_type.address)
+        self.server.connect()
+
+        BACKEND_CONNECT_SECONDS.observe(time.monotonic() - start, (connection_type.name,))
+        ACTIVE_CONNECTIONS.inc(labels=(connection_type.name,))
+        self.__backend = connection_type.name
+        self.__timers.detected()
+
+    def expire(self, reason: str) -> None:
+        logger.info('%s -> tempo esgotado (%s)' % (self.client, reason))
+
+        self.client.shutdown()
+        if self.server is not None:
+            self.server.shutdown()
+
+    def _process_request(self) -> None:
+        data = self.client.peek(ProtocolSniffer.size)
+        if data is None:
+            self.running = False
+            return
+
+        if self.__sniff_deadline is None:
+            self.__sniff_deadline = time.monotonic() + ProtocolSniffer.timeout
+
+        connection_type, complete = ConnectionTypeFactory.table.match(data)
+        if not complete and time.monotonic() < self.__sniff_deadline:
+            time.sleep(0.01)
             return
 
-        connection_type = ConnectionTypeFactory.get_type(data)
-        if connection_type:
+        self.__sniff_deadline = None
+
+        if connection_type is None:
+            request = self.client.consume(ProtocolSniffer.split_request(data))
+            TRANSFERRED_BYTES.inc(len(request), ('in',))
             logger.info(
-                '%s -> Modo %s - %s:%s',
+                '%s -> Solicitação: %s',
                 self.client,
-                connection_type.name,
-                *connection_type.address,
+                request,
             )
-            self.server = Server.of(connection_type.address)
-            self.server.connect()
-            self.server.queue(data)
+            self.client.queue(self.__http_response_parser.parse(request))
+
+            connection_type, _ = ConnectionTypeFactory.table.match(data[len(request) :])
+
+        if connection_type is not None:
+            self._connect(connection_type)
+
+    @property
+    def throttled(self) -> bool:
+        return bool(self.__paused)
+
+    def _set_paused(self, connection: Connection, paused: bool) -> None:
+        throttled = self.throttled
+        if paused:
+            self.__paused.add(connection)
+        else:
+            self.__paused.discard(connection)
+
+        if throttled == self.throttled:
             return
 
-        logger.info(
-            '%s -> Solicitação: %s',
-            self.client,
-            data,
-        )
-        self.client.queue(self.__http_response_parser.parse(data))
+        if self.throttled:
+            THROTTLED_CONNECTIONS.inc()
+            logger.debug('%s -> leitura pausada' % connection)
+        else:
+            THROTTLED_CONNECTIONS.dec()
+            logger.debug('%s -> leitura retomada' % connection)
+
+    def _can_read(self, reader: Connection, writer: Connection) -> bool:
+        if reader in self.__paused:
+            if writer.pending <= self.low_water:
+                self._set_paused(reader, False)
+        elif writer.pending >= self.high_water:
+            self._set_paused(reader, True)
+
+        return reader not in self.__paused
+
+    def _get_limit(self, reader: Connection) -> Optional[BandwidthLimit]:
+        return self.__limits[0] if reader is self.client else self.__limits[1]
+
+    def _is_shaped(self, reader: Connection) -> bool:
+        limit = self._get_limit(reader)
+        if limit is None or limit.allowance(1) > 0:
+            return False
+
+        delay = limit.delay()
+        self.__wake = delay if self.__wake is None else min(self.__wake, delay)
+        return True
+
+    def _read(self, reader: Connection) -> Optional[bytes]:
+        limit = self._get_limit(reader)
+        if limit is None:
+            return reader.read()
+
+        data = reader.read(limit.allowance(Connection.read_size))
+        if data:
+            limit.charge(len(data))
+        return data
+
+    @staticmethod
+    def _buffered(rlist: List[socket.socket]) -> List[socket.socket]:
+        return [conn for conn in rlist if isinstance(conn, ssl.SSLSocket) and conn.pending()]
 
     def _get_waitable_lists(self) -> Tuple[List[socket.socket]]:
-        r, w, e = ([self.client.conn], [], [])  # type: ignore
+        r, w, e = ([], [], [])  # type: ignore
+        self.__wake = None
 
-        if self.server and not self.server.closed:
-            r.append(self.server.conn)
+        if not self.server or self.server.closed:
+            r.append(self.client.conn)
+        else:
+            if self._can_read(self.client, self.server) and not self._is_shaped(self.client):
+                r.append(self.client.conn)
 
-        if self.client.buffer:
+            if self._can_read(self.server, self.client) and not self._is_shaped(self.server):
+                r.append(self.server.conn)
+
+        if self.client.pending:
             w.append(self.client.conn)
 
-        if self.server and not self.server.closed and self.server.buffer:
+        if self.server and not self.server.closed and self.server.pending:
             w.append(self.server.conn)
 
         return r, w, e  # type: ignore
@@ -298,6 +1221,7 @@ class Proxy(threading.Thread):
     def _process_wlist(self, wlist: List[socket.socket]) -> None:
         if self.client.conn in wlist:
             sent = self.client.flush()
+            TRANSFERRED_BYTES.inc(sent, ('out',))
             logger.debug('%s -> enviado %s bytes' % (self.client, sent))
 
         if self.server and not self.server.closed and self.server.conn in wlist:
@@ -305,15 +1229,23 @@ class Proxy(threading.Thread):
             logger.debug('%s -> enviado %s bytes' % (self.server, sent))
 
     def _process_rlist(self, rlist: List[socket.socket]) -> None:
+        if rlist:
+            self.__timers.touch()
+
         if self.client.conn in rlist:
-            data = self.client.read(8192)
+            if not self.server or self.server.closed:
+                self._process_request()
+                return
+
+            data = self._read(self.client)
             self.running = data is not None
             if data and self.running:
-                self._process_request(data)
+                TRANSFERRED_BYTES.inc(len(data), ('in',))
+                self.server.queue(data)
                 logger.debug('%s -> recebido %s bytes' % (self.client, len(data)))
 
         if self.server and not self.server.closed and self.server.conn in rlist:
-            data = self.server.read(8192)
+            data = self._read(self.server)
             self.running = data is not None
             if data and self.running:
                 self.client.queue(data)
@@ -324,18 +1256,72 @@ class Proxy(threading.Thread):
 
         while self.running:
             rlist, wlist, xlist = self._get_waitable_lists()  # type: ignore
-            r, w, _ = select.select(rlist, wlist, xlist, 1)  # type: ignore
+            buffered = self._buffered(rlist)
+            r, w, _ = select.select(
+                rlist, wlist, xlist, 0 if buffered else self.__wake  # type: ignore
+            )
+            r = list(set(r).union(buffered))
 
             self._process_wlist(w)
             self._process_rlist(r)
 
+            if self.running and self._can_splice():
+                self._splice()
+
+    def _can_splice(self) -> bool:
+        return (
+            self.use_splice
+            and self.server is not None
+            and not self.server.closed
+            and not self.client.pending
+            and not self.server.pending
+            and not self.client.unread
+            and SpliceRelay.is_supported(self.client.conn, self.server.conn)
+        )
+
+    def _splice(self) -> None:
+        logger.debug('%s -> Modo splice' % self.client)
+
+        relay = SpliceRelay(
+            self.client.conn,
+            self.server.conn,
+            self.__timers.touch,
+            self.__limits,
+        )
+        try:
+            relay.relay()
+        finally:
+            self.running = False
+            TRANSFERRED_BYTES.inc(relay.transferred[0], ('in',))
+            TRANSFERRED_BYTES.inc(relay.transferred[1], ('out',))
+
+        logger.debug(
+            '%s -> splice enviado %s bytes, recebido %s bytes'
+            % (self.client, *relay.transferred)
+        )
+
     def run(self) -> None:
+        self.__limits = SHAPER.acquire(self.client.addr[0])
+
         try:
             logger.info('%s conectado' % self.client)
+            self.__timers.start()
             self._process()
         except Exception as e:
             logger.exception('%s Erro: %s' % (self.client, e))
         finally:
+            self.__timers.cancel()
+
+            if self.throttled:
+                THROTTLED_CONNECTIONS.dec()
+
+            if self.__backend is not None:
+                ACTIVE_CONNECTIONS.dec(labels=(self.__backend,))
+            else:
+                DETECTION_FAILURES.inc()
+
+            ADMISSION.release(self.client.addr[0])
+            SHAPER.release(self.client.addr[0])
             self.client.close()
             if self.server and not self.server.closed:
                 self.server.close()
@@ -343,13 +1329,272 @@ class Proxy(threading.Thread):
             logger.info('%s desconectado' % self.client)
 
 
-class TCP:
-    def __init__(self, addr: Tuple[str, int], backlog: int = 5):
-        self.__addr = addr
-        self.__backlog = backlog
+def is_terminal_hangup() -> bool:
+    try:
+        termios.tcgetattr(sys.stdin.fileno())
+    except termios.error as e:
+        return e.args[0] == errno.EIO
+    except (AttributeError, ValueError, OSError):
+        return False
+    return False
 
-        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+def handle_reload_signal(callback: Callable[[], None]) -> None:
+    if threading.current_thread() is not threading.main_thread():
+        return
+
+    def handler(signum, frame) -> None:
+        if is_terminal_hangup():
+            raise KeyboardInterrupt()
+        callback()
+
+    signal.signal(signal.SIGHUP, handler)
+
+
+class TLSContext:
+    def __init__(self, cert: str) -> None:
+        self.__cert = cert
+        self.__lock = threading.Lock()
+        self.__context = self._create()
+
+    @property
+    def context(self) -> ssl.SSLContext:
+        return self.__context
+
+    def _create(self) -> ssl.SSLContext:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        context.maximum_version = ssl.TLSVersion.TLSv1_2
+        context.options &= ~ssl.OP_NO_TICKET
+        context.load_cert_chain(certfile=self.__cert, keyfile=self.__cert)
+        return context
+
+    def wrap(self, conn: socket.socket) -> ssl.SSLSocket:
+        return self.__context.wrap_socket(conn, server_side=True)
+
+    def reload(self) -> bool:
+        try:
+            self._create()
+            with self.__lock:
+                self.__context.load_cert_chain(certfile=self.__cert, keyfile=self.__cert)
+        except (OSError, ssl.SSLError) as e:
+            logger.error('Erro ao recarregar certificado %s: %s' % (self.__cert, e))
+            return False
+
+        stats = self.__context.session_stats()
+        logger.info(
+            'Certificado %s recarregado (sessões: %d, reutilizadas: %d)'
+            % (self.__cert, stats['number'], stats['hits'])
+        )
+        return True
+
+
+HandshakeHandler = Callable[[socket.socket, Tuple[str, int]], None]
+
+
+class HandshakePool:
+    workers = 32
+    queue_size = 1024
+    timeout = 10.0
+    overflow = 'drop-oldest'
+
+    __shared: Optional['HandshakePool'] = None
+    __shared_lock = threading.Lock()
+
+    def __init__(self, handler: Optional[HandshakeHandler] = None) -> None:
+        self.__handler = handler
+        self.__queue: Deque[
+            Tuple[socket.socket, Tuple[str, int], Optional[HandshakeHandler]]
+        ] = collections.deque()
+        self.__condition = threading.Condition()
+        self.__threads: List[threading.Thread] = []
+
+    @classmethod
+    def shared(cls) -> 'HandshakePool':
+        with cls.__shared_lock:
+            if cls.__shared is None:
+                cls.__shared = cls()
+                cls.__shared.start()
+            return cls.__shared
+
+    def start(self) -> None:
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def submit(
+        self,
+        conn: socket.socket,
+        addr: Tuple[str, int],
+        handler: Optional[HandshakeHandler] = None,
+    ) -> bool:
+        accepted = True
+        dropped = None
+
+        with self.__condition:
+            if len(self.__queue) < self.queue_size:
+                self.__queue.append((conn, addr, handler))
+                HANDSHAKE_QUEUE.inc()
+            elif self.overflow == 'reject':
+                accepted = False
+                dropped = (conn, addr, handler)
+            else:
+                dropped = self.__queue.popleft()
+                self.__queue.append((conn, addr, handler))
+
+            self.__condition.notify()
+
+        if dropped is not None:
+            logger.debug('Cliente - %s:%s -> handshake descartado, fila cheia' % dropped[1])
+            ADMISSION.release(dropped[1][0])
+            dropped[0].close()
+
+        return accepted
+
+    def _work(self) -> None:
+        while True:
+            with self.__condition:
+                while not self.__queue:
+                    self.__condition.wait()
+
+                conn, addr, handler = self.__queue.popleft()
+                HANDSHAKE_QUEUE.dec()
+
+            start = time.monotonic()
+            try:
+                conn.settimeout(self.timeout)
+                (handler or self.__handler)(conn, addr)
+            except Exception as e:
+                logger.debug('Cliente - %s:%s -> handshake falhou: %s' % (*addr, e))
+                ADMISSION.release(addr[0])
+                conn.close()
+            finally:
+                HANDSHAKE_SECONDS.observe(time.monotonic() - start)
+
+
+def raise_nofile_limit(target: int = 65536) -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    candidates = [(target, target)]
+    if hard != resource.RLIM_INFINITY:
+        candidates.append((min(target, hard), hard))
+
+    for limits in candidates:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, limits)
+            break
+        except (ValueError, OSError):
+            continue
+
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+class AdmissionControl:
+    max_connections = 0
+    max_per_ip = 0
+    rate = 0.0
+    burst = 0
+    reserved_fds = 64
+    max_buckets = 4096
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__active = 0
+        self.__per_ip: Dict[str, int] = {}
+        self.__buckets: Dict[str, TokenBucket] = {}
+        self.__limit: Optional[int] = None
+
+    @property
+    def active(self) -> int:
+        return self.__active
+
+    @property
+    def limit(self) -> int:
+        if self.max_connections > 0:
+            return self.max_connections
+
+        if self.__limit is None:
+            fds_per_session = 4 if Proxy.use_splice and hasattr(os, 'splice') else 2
+            soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+            self.__limit = max((soft - self.reserved_fds) // fds_per_session, 1)
+
+        return self.__limit
+
+    def _bucket(self, ip: str) -> TokenBucket:
+        bucket = self.__buckets.get(ip)
+        if bucket is None:
+            if len(self.__buckets) >= self.max_buckets:
+                self.__buckets = {
+                    key: value for key, value in self.__buckets.items() if not value.full()
+                }
+            bucket = self.__buckets[ip] = TokenBucket(self.rate, self.burst or self.rate)
+        return bucket
+
+    def admit(self, ip: str) -> bool:
+        with self.__lock:
+            if self.__active >= self.limit:
+                reason = 'global'
+            elif self.max_per_ip > 0 and self.__per_ip.get(ip, 0) >= self.max_per_ip:
+                reason = 'ip_limit'
+            elif self.rate > 0 and not self._bucket(ip).consume():
+                reason = 'ip_rate'
+            else:
+                self.__active += 1
+                self.__per_ip[ip] = self.__per_ip.get(ip, 0) + 1
+                return True
+
+        REJECTED_CONNECTIONS.inc(labels=(reason,))
+        logger.debug('Cliente - %s -> conexão recusada (%s)' % (ip, reason))
+        return False
+
+    def release(self, ip: str) -> None:
+        with self.__lock:
+            count = self.__per_ip.get(ip, 0)
+            if count <= 0:
+                return
+
+            self.__active -= 1
+            if count == 1:
+                del self.__per_ip[ip]
+            else:
+                self.__per_ip[ip] = count - 1
+
+
+ADMISSION = AdmissionControl()
+
+
+def create_listener(
+    addr: Tuple[str, int],
+    backlog: int = 5,
+    reuse_port: bool = False,
+) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    sock.bind(addr)
+    sock.listen(backlog)
+    return sock
+
+
+class TCP:
+    def __init__(
+        self,
+        addr: Tuple[str, int],
+        backlog: int = 5,
+        reuse_port: bool = False,
+        sock: Optional[socket.socket] = None,
+    ):
+        self.__addr = addr
+        self.__backlog = backlog
+        self.__reuse_port = reuse_port
+        self.__sock = sock
+        self.__wakeup = socket.socketpair()
+        self.__stopped = False
 
     def __str__(self) -> str:
         return '%s - %s:%d' % (self.__class__.__name__, *self.__addr)
@@ -357,20 +1602,50 @@ class TCP:
     def handle(self, conn: socket.socket, addr: Tuple[str, int]) -> None:
         raise NotImplementedError()
 
+    def listen(self) -> None:
+        if self.__sock is None:
+            self.__sock = create_listener(self.__addr, self.__backlog, self.__reuse_port)
+
+    def reload(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        self.__stopped = True
+        self.__wakeup[1].send(b'\0')
+
     def run(self) -> None:
-        self.__sock.bind(self.__addr)
-        self.__sock.listen(self.__backlog)
+        self.listen()
+        self.__sock.setblocking(False)
 
         logger.info('Servidor %s iniciado' % self)
 
         try:
-            while True:
-                conn, addr = self.__sock.accept()
-                self.handle(conn, addr)
+            while not self.__stopped:
+                ready, _, _ = select.select([self.__sock, self.__wakeup[0]], [], [])
+                if self.__wakeup[0] in ready:
+                    break
+
+                try:
+                    conn, addr = self.__sock.accept()
+                except BlockingIOError:
+                    continue
+
+                ACCEPTED_CONNECTIONS.inc()
+
+                if not ADMISSION.admit(addr[0]):
+                    conn.close()
+                    continue
+
+                try:
+                    self.handle(conn, addr)
+                except Exception as e:
+                    logger.exception('Cliente - %s:%s Erro: %s' % (*addr, e))
+                    ADMISSION.release(addr[0])
+                    conn.close()
         except KeyboardInterrupt:
             pass
         finally:
-            logger.info('Finalizando servidor...')
+            logger.info('Finalizando servidor %s' % self)
             self.__sock.close()
 
 
@@ -383,18 +1658,23 @@ class HTTP(TCP):
 
 
 class HTTPS(TCP):
-    def __init__(self, addr: Tuple[str, int], cert: str, backlog: int = 5) -> None:
-        super().__init__(addr, backlog)
-        self.__cert = cert
+    def __init__(
+        self,
+        addr: Tuple[str, int],
+        cert: str,
+        backlog: int = 5,
+        reuse_port: bool = False,
+        sock: Optional[socket.socket] = None,
+    ) -> None:
+        super().__init__(addr, backlog, reuse_port, sock)
+        self.__tls = TLSContext(cert)
+
+    def reload(self) -> None:
+        self.__tls.reload()
 
     def handle_thread(self, conn: socket.socket, addr: Tuple[str, int]) -> None:
-        conn = ssl.wrap_socket(
-            sock=conn,
-            keyfile=self.__cert,
-            certfile=self.__cert,
-            server_side=True,
-            ssl_version=ssl.PROTOCOL_TLSv1_2,
-        )
+        conn = self.__tls.wrap(conn)
+        conn.settimeout(None)
 
         client = Client(conn, addr)
         proxy = Proxy(client)
@@ -402,10 +1682,919 @@ class HTTPS(TCP):
         proxy.start()
 
     def handle(self, conn: socket.socket, addr: Tuple[str, int]) -> None:
-        thread = threading.Thread(target=self.handle_thread, args=(conn, addr))
+        HandshakePool.shared().submit(conn, addr, self.handle_thread)
+
+
+class AsyncProxy:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.addr = writer.get_extra_info('peername')[:2]
+        self.server_reader: Optional[asyncio.StreamReader] = None
+        self.server_writer: Optional[asyncio.StreamWriter] = None
+        self.backend: Optional[str] = None
+        self.__timers = SessionTimers(self.expire)
+        self.__limits: Tuple[Optional[BandwidthLimit], Optional[BandwidthLimit]] = (None, None)
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__http_response_parser = WebsocketParseResponse(HttpParseResponse())
+
+    def __str__(self):
+        return 'Cliente - %s:%s' % self.addr
+
+    def _abort(self) -> None:
+        self.writer.transport.abort()
+        if self.server_writer is not None:
+            self.server_writer.transport.abort()
+
+    def expire(self, reason: str) -> None:
+        logger.info('%s -> tempo esgotado (%s)' % (self, reason))
+        self.__loop.call_soon_threadsafe(self._abort)
+
+    async def _connect(self, connection_type: ConnectionTypeParser) -> None:
+        logger.info(
+            '%s -> Modo %s - %s:%s',
+            self,
+            connection_type.name,
+            *connection_type.address,
+        )
+        start = time.monotonic()
+        self.server_reader, self.server_writer = await asyncio.wait_for(
+            asyncio.open_connection(*connection_type.address),
+            5,
+        )
+
+        BACKEND_CONNECT_SECONDS.observe(time.monotonic() - start, (connection_type.name,))
+        ACTIVE_CONNECTIONS.inc(labels=(connection_type.name,))
+        self.backend = connection_type.name
+        self.__timers.detected()
+
+    async def _process_request(self) -> Optional[bytes]:
+        loop = asyncio.get_running_loop()
+        data = b''
+        deadline = 0.0
+
+        while True:
+            if not data:
+                data = await self.reader.read(Connection.read_size)
+                if not data:
+                    return None
+                deadline = loop.time() + ProtocolSniffer.timeout
+
+            connection_type, complete = ConnectionTypeFactory.table.match(data)
+            remaining = deadline - loop.time()
+
+            if not complete and remaining > 0:
+                try:
+                    more = await asyncio.wait_for(
+                        self.reader.read(Connection.read_size),
+                        remaining,
+                    )
+                except asyncio.TimeoutError:
+                    deadline = 0.0
+                    continue
+
+                if not more:
+                    return None
+                data += more
+                continue
+
+            if connection_type is not None:
+                await self._connect(connection_type)
+                return data
+
+            size = ProtocolSniffer.split_request(data)
+            request, data = data[:size], data[size:]
+            TRANSFERRED_BYTES.inc(len(request), ('in',))
+
+            logger.info(
+                '%s -> Solicitação: %s',
+                self,
+                request,
+            )
+            response = self.__http_response_parser.parse(request)
+            TRANSFERRED_BYTES.inc(len(response), ('out',))
+            self.writer.write(response)
+            await self.writer.drain()
+            deadline = loop.time() + ProtocolSniffer.timeout
+
+    async def _drain(self, writer: asyncio.StreamWriter) -> None:
+        if writer.transport.get_write_buffer_size() < Proxy.high_water:
+            await writer.drain()
+            return
+
+        THROTTLED_CONNECTIONS.inc()
+        try:
+            await writer.drain()
+        finally:
+            THROTTLED_CONNECTIONS.dec()
+
+    async def _relay(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        direction: str,
+        limit: Optional[BandwidthLimit] = None,
+    ) -> None:
+        writer.transport.set_write_buffer_limits(high=Proxy.high_water, low=Proxy.low_water)
+
+        while True:
+            size = Connection.read_size
+            if limit is not None:
+                size = limit.allowance(size)
+                if size == 0:
+                    await asyncio.sleep(limit.delay())
+                    continue
+
+            data = await reader.read(size)
+            if not data:
+                break
+
+            if limit is not None:
+                limit.charge(len(data))
+
+            self.__timers.touch()
+            TRANSFERRED_BYTES.inc(len(data), (direction,))
+            writer.write(data)
+            await self._drain(writer)
+
+    async def _process(self) -> None:
+        data = await self._process_request()
+        if data is None:
+            return
+
+        TRANSFERRED_BYTES.inc(len(data), ('in',))
+        if self.__limits[0] is not None:
+            self.__limits[0].charge(len(data))
+        self.server_writer.write(data)
+
+        upload, download = self.__limits
+        tasks = [
+            asyncio.ensure_future(self._relay(self.reader, self.server_writer, 'in', upload)),
+            asyncio.ensure_future(self._relay(self.server_reader, self.writer, 'out', download)),
+        ]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+        for task in pending:
+            task.cancel()
+
+        for task in done:
+            task.result()
+
+    async def run(self) -> None:
+        self.__limits = SHAPER.acquire(self.addr[0])
+
+        try:
+            logger.info('%s conectado' % self)
+            self.__loop = asyncio.get_running_loop()
+            self.__timers.start()
+            await self._process()
+        except Exception as e:
+            logger.exception('%s Erro: %s' % (self, e))
+        finally:
+            self.__timers.cancel()
+
+            if self.backend is not None:
+                ACTIVE_CONNECTIONS.dec(labels=(self.backend,))
+            else:
+                DETECTION_FAILURES.inc()
+
+            SHAPER.release(self.addr[0])
+            self.writer.close()
+            if self.server_writer is not None:
+                self.server_writer.close()
+
+            logger.info('%s desconectado' % self)
+
+
+class AsyncTCP:
+    def __init__(
+        self,
+        addr: Tuple[str, int],
+        backlog: int = 5,
+        reuse_port: bool = False,
+        sock: Optional[socket.socket] = None,
+    ):
+        self.__addr = addr
+        self.__backlog = backlog
+        self.__reuse_port = reuse_port
+        self.__sock = sock
+
+    def __str__(self) -> str:
+        return '%s - %s:%d' % (self.__class__.__name__, *self.__addr)
+
+    @property
+    def ssl_context(self) -> Optional[ssl.SSLContext]:
+        return None
+
+    def listen(self) -> None:
+        if self.__sock is None:
+            self.__sock = create_listener(self.__addr, self.__backlog, self.__reuse_port)
+
+    def reload(self) -> None:
+        pass
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        ACCEPTED_CONNECTIONS.inc()
+
+        ip = writer.get_extra_info('peername')[0]
+        if not ADMISSION.admit(ip):
+            writer.transport.abort()
+            return
+
+        try:
+            await AsyncProxy(reader, writer).run()
+        finally:
+            ADMISSION.release(ip)
+
+    async def start(self) -> asyncio.AbstractServer:
+        self.listen()
+
+        server = await asyncio.start_server(
+            self.handle,
+            sock=self.__sock,
+            backlog=self.__backlog,
+            ssl=self.ssl_context,
+            ssl_handshake_timeout=HandshakePool.timeout if self.ssl_context else None,
+        )
+
+        logger.info('Servidor %s iniciado' % self)
+        return server
+
+    def run(self) -> None:
+        group = AsyncServerGroup()
+        group.add(str(self), self)
+        group.run()
+
+
+class AsyncHTTP(AsyncTCP):
+    pass
+
+
+class AsyncHTTPS(AsyncTCP):
+    def __init__(
+        self,
+        addr: Tuple[str, int],
+        cert: str,
+        backlog: int = 5,
+        reuse_port: bool = False,
+        sock: Optional[socket.socket] = None,
+    ) -> None:
+        super().__init__(addr, backlog, reuse_port, sock)
+        self.__tls = TLSContext(cert)
+
+    @property
+    def ssl_context(self) -> Optional[ssl.SSLContext]:
+        return self.__tls.context
+
+    def reload(self) -> None:
+        self.__tls.reload()
+
+
+LISTEN_MODES = ('http', 'https')
+
+
+def parse_listen(value: str, host: str = '0.0.0.0') -> Tuple[str, Tuple[str, int]]:
+    mode, _, address = value.partition(':')
+    listen_host, _, port = address.rpartition(':')
+
+    if mode not in LISTEN_MODES or not port.isdigit():
+        raise ValueError('Invalid listener %s, expected <mode>:[host:]port' % value)
+
+    return mode, (listen_host or host, int(port))
+
+
+def listener_name(mode: str, addr: Tuple[str, int]) -> str:
+    return '%s:%s:%d' % (mode, *addr)
+
+
+class ServerGroup:
+    drain_timeout = 0.0
+
+    def __init__(self) -> None:
+        self.__servers: Dict[str, TCP] = {}
+        self.__lock = threading.Lock()
+        self.__running = False
+        self.__draining = False
+        self.__stopped = threading.Event()
+
+    @property
+    def names(self) -> List[str]:
+        return sorted(self.__servers)
+
+    def _start(self, server: TCP) -> None:
+        thread = threading.Thread(target=server.run)
         thread.daemon = True
         thread.start()
 
+    def add(self, name: str, server: TCP) -> None:
+        with self.__lock:
+            if name in self.__servers:
+                raise ValueError('Listener %s already exists' % name)
+
+            self.__servers[name] = server
+            if self.__running:
+                self._start(server)
+
+    def remove(self, name: str) -> None:
+        with self.__lock:
+            server = self.__servers.pop(name, None)
+
+        if server is None:
+            raise ValueError('Listener %s not found' % name)
+        server.stop()
+
+    def reload(self) -> None:
+        Remotes.reload()
+        for server in list(self.__servers.values()):
+            server.reload()
+
+    def stop(self) -> None:
+        self.__draining = True
+        with self.__lock:
+            for server in self.__servers.values():
+                server.stop()
+        self.__stopped.set()
+
+    def drain(self) -> None:
+        deadline = time.monotonic() + self.drain_timeout
+        logger.info('Aguardando %d conexões' % ADMISSION.active)
+
+        while ADMISSION.active and (self.drain_timeout <= 0 or time.monotonic() < deadline):
+            time.sleep(0.5)
+
+    def run(self) -> None:
+        handle_reload_signal(self.reload)
+
+        with self.__lock:
+            self.__running = True
+            for server in self.__servers.values():
+                self._start(server)
+
+        try:
+            self.__stopped.wait()
+        except KeyboardInterrupt:
+            return
+        finally:
+            logger.info('Finalizando servidor...')
+
+        if self.__draining:
+            self.drain()
+
+
+class AsyncServerGroup:
+    drain_timeout = 0.0
+
+    def __init__(self) -> None:
+        self.__servers: Dict[str, AsyncTCP] = {}
+        self.__handles: Dict[str, Optional[asyncio.AbstractServer]] = {}
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__stop: Optional[asyncio.Event] = None
+        self.__draining = False
+
+    @property
+    def names(self) -> List[str]:
+        return sorted(self.__servers)
+
+    async def _start(self, name: str, server: AsyncTCP) -> None:
+        if name in self.__handles:
+            return
+
+        self.__handles[name] = None
+        handle = await server.start()
+        self.__handles[name] = handle
+
+        if self.__servers.get(name) is not server:
+            self._close(name)
+
+    def _close(self, name: str) -> None:
+        handle = self.__handles.pop(name, None)
+        if handle is not None:
+            handle.close()
+
+    def add(self, name: str, server: AsyncTCP) -> None:
+        if name in self.__servers:
+            raise ValueError('Listener %s already exists' % name)
+
+        self.__servers[name] = server
+        if self.__loop is not None:
+            asyncio.run_coroutine_threadsafe(self._start(name, server), self.__loop).result()
+
+    def remove(self, name: str) -> None:
+        if self.__servers.pop(name, None) is None:
+            raise ValueError('Listener %s not found' % name)
+
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self._close, name)
+
+    def reload(self) -> None:
+        Remotes.reload()
+        for server in list(self.__servers.values()):
+            server.reload()
+
+    def stop(self) -> None:
+        self.__draining = True
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__stop.set)
+
+    async def drain(self) -> None:
+        deadline = time.monotonic() + self.drain_timeout
+        logger.info('Aguardando %d conexões' % ADMISSION.active)
+
+        while ADMISSION.active and (self.drain_timeout <= 0 or time.monotonic() < deadline):
+            await asyncio.sleep(0.5)
+
+    async def serve(self) -> None:
+        self.__stop = asyncio.Event()
+        self.__loop = asyncio.get_running_loop()
+        for name, server in list(self.__servers.items()):
+            await self._start(name, server)
+
+        if not self.__draining:
+            await self.__stop.wait()
+
+        for name in list(self.__handles):
+            self._close(name)
+
+        if self.__draining:
+            await self.drain()
+
+    def run(self) -> None:
+        handle_reload_signal(self.reload)
+
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info('Finalizando servidor...')
+
+
+class MetricsServer(threading.Thread):
+    def __init__(
+        self,
+        address: Union[Tuple[str, int], str],
+        collect: Callable[[], List[List[list]]],
+    ) -> None:
+        super().__init__()
+        self.daemon = True
+        self.__collect = collect
+
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        self.__sock.bind(address)
+        self.__sock.listen(16)
+
+    @property
+    def address(self) -> Union[Tuple[str, int], str]:
+        return self.__sock.getsockname()
+
+    def close(self) -> None:
+        self.__sock.close()
+
+    def _handle(self, conn: socket.socket) -> None:
+        conn.settimeout(2)
+
+        request = b''
+        while b'\r\n\r\n' not in request and len(request) < 8192:
+            data = conn.recv(1024)
+            if not data:
+                break
+            request += data
+
+        body = REGISTRY.render(self.__collect()).encode()
+        conn.sendall(
+            b'\r\n'.join(
+                [
+                    b'HTTP/1.1 200 OK',
+                    b'Content-Type: ' + REGISTRY.content_type.encode(),
+                    b'Content-Length: %d' % len(body),
+                    b'Connection: close',
+                    b'',
+                    body,
+                ]
+            )
+        )
+
+    def run(self) -> None:
+        logger.info('Métricas disponíveis em %s' % (self.address,))
+
+        while self.__sock.fileno() != -1:
+            try:
+                conn, _ = self.__sock.accept()
+            except OSError as e:
+                logger.debug('Erro ao aceitar conexão de métricas: %s' % e)
+                time.sleep(0.1)
+                continue
+
+            try:
+                self._handle(conn)
+            except OSError as e:
+                logger.debug('Erro ao enviar métricas: %s' % e)
+            finally:
+                conn.close()
+
+
+class MetricsReporter(threading.Thread):
+    def __init__(self, channel: socket.socket) -> None:
+        super().__init__()
+        self.daemon = True
+        self.__channel = channel
+
+    def run(self) -> None:
+        while self.__channel.recv(1):
+            self.__channel.sendall(json.dumps(REGISTRY.snapshot()).encode() + b'\n')
+
+    @staticmethod
+    def request(channel: socket.socket, timeout: float = 1) -> List[list]:
+        channel.settimeout(timeout)
+        channel.sendall(b'?')
+
+        response = b''
+        while not response.endswith(b'\n'):
+            data = channel.recv(65536)
+            if not data:
+                raise ConnectionError('Worker channel closed')
+            response += data
+
+        return json.loads(response)
+
+
+def send_fds(sock: socket.socket, data: bytes, fds: List[int]) -> None:
+    ancillary = []
+    if fds:
+        ancillary.append((socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds)))
+    sock.sendmsg([data], ancillary)
+
+
+def recv_fds(sock: socket.socket, size: int, max_fds: int) -> Tuple[bytes, List[int]]:
+    fds = array.array('i')
+    data, ancillary, _, _ = sock.recvmsg(size, socket.CMSG_LEN(max_fds * fds.itemsize))
+
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[: len(payload) - (len(payload) % fds.itemsize)])
+
+    return data, list(fds)
+
+
+ControlHandler = Callable[[socket.socket, List[str]], None]
+
+
+class ControlServer(threading.Thread):
+    max_fds = 64
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.daemon = True
+        self.__commands: Dict[str, ControlHandler] = {}
+
+        if os.path.exists(path):
+            os.unlink(path)
+
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__sock.bind(path)
+        self.__sock.listen(16)
+
+    @property
+    def path(self) -> str:
+        return self.__sock.getsockname()
+
+    def register(self, name: str, handler: ControlHandler) -> None:
+        self.__commands[name] = handler
+
+    def close(self) -> None:
+        self.__sock.close()
+
+    def _handle(self, conn: socket.socket) -> None:
+        conn.settimeout(2)
+
+        request = b''
+        while not request.endswith(b'\n') and len(request) < 8192:
+            data = conn.recv(1024)
+            if not data:
+                break
+            request += data
+
+        args = request.decode(errors='replace').split()
+        handler = self.__commands.get(args[0]) if args else None
+        if handler is None:
+            conn.sendall(b'ERR unknown command\n')
+            return
+
+        try:
+            handler(conn, args[1:])
+        except (OSError, ValueError) as e:
+            conn.sendall(b'ERR %s\n' % str(e).encode())
+
+    def run(self) -> None:
+        logger.info('Controle disponível em %s' % self.path)
+
+        while self.__sock.fileno() != -1:
+            try:
+                conn, _ = self.__sock.accept()
+            except OSError as e:
+                logger.debug('Erro ao aceitar conexão de controle: %s' % e)
+                time.sleep(0.1)
+                continue
+
+            try:
+                self._handle(conn)
+            except Exception as e:
+                logger.exception('Erro no comando de controle: %s' % e)
+            finally:
+                conn.close()
+
+    @classmethod
+    def request(
+        cls,
+        path: str,
+        command: str,
+        timeout: float = 5,
+    ) -> Tuple[bytes, List[socket.socket]]:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(timeout)
+
+        try:
+            conn.connect(path)
+            conn.sendall(command.encode() + b'\n')
+
+            response, fds = recv_fds(conn, 65536, cls.max_fds)
+            while response and not response.endswith(b'\n'):
+                data = conn.recv(65536)
+                if not data:
+                    break
+                response += data
+        finally:
+            conn.close()
+
+        return response, [socket.socket(fileno=fd) for fd in fds]
+
+
+Listener = Tuple[str, Tuple[str, int], socket.socket]
+
+
+class ListenerSet:
+    def __init__(self, copies: int = 1, backlog: int = 5) -> None:
+        self.__copies = copies
+        self.__backlog = backlog
+        self.__listeners: Dict[str, Tuple[str, Tuple[str, int], List[socket.socket]]] = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def names(self) -> List[str]:
+        return sorted(self.__listeners)
+
+    @property
+    def copies(self) -> int:
+        return max([self.__copies] + [len(item[2]) for item in self.__listeners.values()])
+
+    def add(
+        self,
+        mode: str,
+        addr: Tuple[str, int],
+        sockets: Optional[List[socket.socket]] = None,
+    ) -> str:
+        name = listener_name(mode, addr)
+
+        with self.__lock:
+            if name in self.__listeners:
+                raise ValueError('Listener %s already exists' % name)
+
+            if not sockets:
+                sockets = [
+                    create_listener(addr, self.__backlog, self.__copies > 1)
+                    for _ in range(self.__copies)
+                ]
+            self.__listeners[name] = (mode, addr, sockets)
+
+        return name
+
+    def remove(self, name: str) -> None:
+        with self.__lock:
+            item = self.__listeners.pop(name, None)
+
+        if item is None:
+            raise ValueError('Listener %s not found' % name)
+
+        for sock in item[2]:
+            sock.close()
+
+    def get(self, name: str, slot: int = 0) -> Listener:
+        mode, addr, sockets = self.__listeners[name]
+        return mode, addr, sockets[slot % len(sockets)]
+
+    def select(self, slot: int) -> List[Listener]:
+        with self.__lock:
+            return [self.get(name, slot) for name in self.names]
+
+    def keep(self, slot: int) -> List[Listener]:
+        selected = self.select(slot)
+        own = [sock for _, _, sock in selected]
+
+        with self.__lock:
+            for _, _, sockets in self.__listeners.values():
+                for sock in sockets:
+                    if sock not in own:
+                        sock.close()
+
+        return selected
+
+    def export(self) -> Tuple[List[list], List[int]]:
+        specs: List[list] = []
+        fds: List[int] = []
+
+        with self.__lock:
+            for mode, addr, sockets in self.__listeners.values():
+                for sock in sockets:
+                    specs.append([mode, *addr])
+                    fds.append(sock.fileno())
+
+        return specs, fds
+
+
+def takeover(path: str) -> List[Listener]:
+    response, sockets = ControlServer.request(path, 'takeover')
+    status, _, payload = response.partition(b' ')
+
+    if status != b'OK':
+        for sock in sockets:
+            sock.close()
+        raise ConnectionError('Takeover failed: %s' % response.decode(errors='replace').strip())
+
+    specs = json.loads(payload)
+    logger.info('Recebidos %d sockets de escuta de %s' % (len(sockets), path))
+    return [(mode, (host, port), sock) for (mode, host, port), sock in zip(specs, sockets)]
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        factory: Callable[..., Union[TCP, AsyncTCP, ServerGroup, AsyncServerGroup]],
+        workers: int,
+        restart_delay: float = 1,
+        listeners: Optional[ListenerSet] = None,
+    ) -> None:
+        self.__factory = factory
+        self.__workers = workers
+        self.__restart_delay = restart_delay
+        self.__listeners = listeners
+        self.__pids: Set[int] = set()
+        self.__slots: Dict[int, int] = {}
+        self.__retiring: Set[int] = set()
+        self.__lock = threading.RLock()
+        self.__channels: Dict[int, socket.socket] = {}
+        self.__channels_lock = threading.Lock()
+        self.__metrics_server: Optional[MetricsServer] = None
+        self.__running = False
+
+    @property
+    def pids(self) -> Set[int]:
+        return set(self.__pids)
+
+    def serve_metrics(self, address: Union[Tuple[str, int], str]) -> None:
+        self.__metrics_server = MetricsServer(address, self.collect)
+        self.__metrics_server.start()
+
+    def collect(self) -> List[List[list]]:
+        snapshots = []
+
+        with self.__channels_lock:
+            for pid, channel in self.__channels.items():
+                try:
+                    snapshots.append(MetricsReporter.request(channel))
+                except (OSError, ValueError) as e:
+                    logger.debug('Worker %d sem métricas: %s' % (pid, e))
+
+        return snapshots
+
+    def _create(self, slot: int) -> Union[TCP, AsyncTCP, ServerGroup, AsyncServerGroup]:
+        if self.__listeners is None:
+            return self.__factory()
+        return self.__factory(self.__listeners.keep(slot))
+
+    def _spawn(self, slot: int) -> int:
+        channel, worker_channel = socket.socketpair()
+
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                channel.close()
+                for sibling in self.__channels.values():
+                    sibling.close()
+                if self.__metrics_server is not None:
+                    self.__metrics_server.close()
+
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                handle_reload_signal(lambda: None)
+                MetricsReporter(worker_channel).start()
+
+                server = self._create(slot)
+                signal.signal(signal.SIGUSR2, lambda signum, frame: server.stop())
+                server.run()
+            except BaseException as e:
+                logger.exception('Worker %d Erro: %s' % (os.getpid(), e))
+                status = 1
+            finally:
+                os._exit(status)
+
+        worker_channel.close()
+        with self.__channels_lock:
+            self.__channels[pid] = channel
+        self.__slots[pid] = slot
+
+        logger.info('Worker %d iniciado' % pid)
+        return pid
+
+    def _release(self, pid: int) -> int:
+        self.__pids.discard(pid)
+        with self.__channels_lock:
+            channel = self.__channels.pop(pid, None)
+        if channel is not None:
+            channel.close()
+        return self.__slots.pop(pid, 0)
+
+    def _signal(self, signum: int, pids: Optional[Set[int]] = None) -> None:
+        for pid in self.pids if pids is None else pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _terminate(self) -> None:
+        self._signal(signal.SIGTERM)
+
+        for pid in list(self.__pids):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+            self._release(pid)
+
+    def reload(self) -> None:
+        self._signal(signal.SIGHUP)
+
+    def stop(self, *args) -> None:
+        self.__running = False
+        self._signal(signal.SIGTERM)
+
+    def drain(self) -> None:
+        self.__running = False
+        with self.__lock:
+            self.__retiring.update(self.__pids)
+        self._signal(signal.SIGUSR2)
+
+    def rotate(self) -> None:
+        with self.__lock:
+            retiring = self.__pids - self.__retiring
+            for slot in range(self.__workers):
+                self.__pids.add(self._spawn(slot))
+
+            self.__retiring.update(retiring)
+            self._signal(signal.SIGUSR2, retiring)
+
+        logger.info('Workers %s drenando' % ', '.join(map(str, sorted(retiring))))
+
+    def run(self) -> None:
+        self.__running = True
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+        handle_reload_signal(self.reload)
+
+        with self.__lock:
+            for slot in range(self.__workers):
+                self.__pids.add(self._spawn(slot))
+
+        try:
+            while self.__pids:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+
+                with self.__lock:
+                    slot = self._release(pid)
+                    if pid in self.__retiring:
+                        self.__retiring.discard(pid)
+                        continue
+
+                if self.__running:
+                    logger.warning('Worker %d finalizado (status %d), reiniciando...' % (pid, status))
+                    time.sleep(self.__restart_delay)
+                    with self.__lock:
+                        self.__pids.add(self._spawn(slot))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._terminate()
+            logger.info('Finalizando workers...')
+
 
 def main():
     parser = argparse.ArgumentParser(description='Proxy', usage='%(prog)s [options]')
@@ -417,10 +2606,160 @@ def main():
     parser.add_argument('--ssh-port', type=int, default=22, help='SSH Port')
     parser.add_argument('--v2ray-port', type=int, default=1080, help='V2Ray Port')
 
+    parser.add_argument('--remotes', help='Backend file reloaded on SIGHUP ("<name> [host:]port")')
+
     parser.add_argument('--cert', default='./cert.pem', help='Certificate')
 
     parser.add_argument('--http', action='store_true', help='HTTP')
     parser.add_argument('--https', action='store_true', help='HTTPS')
+    parser.add_argument(
+        '--listen',
+        action='append',
+        default=[],
+        help='Listener as <mode>:[host:]port (repeatable, overrides --port/--https)',
+    )
+
+    parser.add_argument(
+        '--engine',
+        default='thread',
+        choices=['thread', 'asyncio'],
+        help='Engine',
+    )
+
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes')
+    parser.add_argument(
+        '--handshake-workers',
+        type=int,
+        default=HandshakePool.workers,
+        help='TLS handshake threads',
+    )
+    parser.add_argument(
+        '--handshake-queue',
+        type=int,
+        default=HandshakePool.queue_size,
+        help='Pending TLS handshakes before overflow',
+    )
+    parser.add_argument(
+        '--handshake-timeout',
+        type=float,
+        default=HandshakePool.timeout,
+        help='TLS handshake timeout in seconds',
+    )
+    parser.add_argument(
+        '--handshake-overflow',
+        default=HandshakePool.overflow,
+        choices=['drop-oldest', 'reject'],
+        help='What to drop when the handshake queue is full',
+    )
+    parser.add_argument('--no-splice', action='store_true', help='Disable splice relay')
+    parser.add_argument('--buffer-size', type=int, default=8192, help='Read buffer size')
+    parser.add_argument('--protocols', help='Protocol prefix table file')
+    parser.add_argument(
+        '--sniff-size',
+        type=int,
+        default=ProtocolSniffer.size,
+        help='Bytes peeked for protocol detection',
+    )
+    parser.add_argument(
+        '--sniff-timeout',
+        type=float,
+        default=ProtocolSniffer.timeout,
+        help='Seconds to wait for an ambiguous protocol prefix',
+    )
+    parser.add_argument(
+        '--high-water',
+        type=int,
+        default=Proxy.high_water,
+        help='Pause reading while the peer has this many pending bytes',
+    )
+    parser.add_argument(
+        '--low-water',
+        type=int,
+        default=Proxy.low_water,
+        help='Resume reading once the peer has this many pending bytes',
+    )
+
+    parser.add_argument('--metrics-host', default='127.0.0.1', help='Metrics host')
+    parser.add_argument('--metrics-port', type=int, help='Metrics port (OpenMetrics)')
+    parser.add_argument('--metrics-socket', help='Metrics unix socket (OpenMetrics)')
+
+    parser.add_argument(
+        '--detect-timeout',
+        type=float,
+        default=SessionTimers.detect_timeout,
+        help='Seconds a client may take to reach a backend (0 disables)',
+    )
+    parser.add_argument(
+        '--idle-timeout',
+        type=float,
+        default=SessionTimers.idle_timeout,
+        help='Seconds without traffic before closing a session (0 disables)',
+    )
+    parser.add_argument(
+        '--max-session-age',
+        type=float,
+        default=SessionTimers.max_age,
+        help='Maximum session duration in seconds (0 disables)',
+    )
+
+    parser.add_argument(
+        '--max-connections',
+        type=int,
+        default=AdmissionControl.max_connections,
+        help='Concurrent connections (0 derives it from the open file limit)',
+    )
+    parser.add_argument(
+        '--max-connections-per-ip',
+        type=int,
+        default=AdmissionControl.max_per_ip,
+        help='Concurrent connections per client IP (0 disables)',
+    )
+    parser.add_argument(
+        '--accept-rate',
+        type=float,
+        default=AdmissionControl.rate,
+        help='New connections per second per client IP (0 disables)',
+    )
+    parser.add_argument(
+        '--accept-burst',
+        type=int,
+        default=AdmissionControl.burst,
+        help='New connection burst per client IP (defaults to --accept-rate)',
+    )
+
+    parser.add_argument(
+        '--upload-rate',
+        type=int,
+        default=BandwidthShaper.upload_rate,
+        help='Client upload limit per connection in bytes/s (0 disables)',
+    )
+    parser.add_argument(
+        '--download-rate',
+        type=int,
+        default=BandwidthShaper.download_rate,
+        help='Client download limit per connection in bytes/s (0 disables)',
+    )
+    parser.add_argument(
+        '--ip-upload-rate',
+        type=int,
+        default=BandwidthShaper.ip_upload_rate,
+        help='Client upload limit per IP in bytes/s (0 disables)',
+    )
+    parser.add_argument(
+        '--ip-download-rate',
+        type=int,
+        default=BandwidthShaper.ip_download_rate,
+        help='Client download limit per IP in bytes/s (0 disables)',
+    )
+
+    parser.add_argument('--control', help='Control unix socket (reload, takeover)')
+    parser.add_argument('--takeover', help='Take the listening sockets over from this control socket')
+    parser.add_argument(
+        '--drain-timeout',
+        type=float,
+        default=ServerGroup.drain_timeout,
+        help='Seconds to wait for sessions after a takeover (0 waits for all)',
+    )
 
     parser.add_argument('--log', default='INFO', help='Log level')
     parser.add_argument('--usage', action='store_true', help='Usage')
@@ -431,16 +2770,102 @@ def main():
     REMOTES_ADDRESS['ssh'] = (args.host, args.ssh_port)
     REMOTES_ADDRESS['v2ray'] = (args.host, args.v2ray_port)
 
-    if args.http:
-        server = HTTP((args.host, args.port), args.backlog)
+    if args.remotes:
+        Remotes.path = args.remotes
+        Remotes.host = args.host
+        try:
+            REMOTES_ADDRESS.update(Remotes.parse(args.remotes, args.host))
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
 
-    elif args.https:
-        if not os.path.exists(args.cert):
-            parser.error('Certificate %s not found' % args.cert)
+    if args.protocols:
+        try:
+            ConnectionTypeFactory.table = ProtocolTable.load(args.protocols)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
 
-        server = HTTPS((args.host, args.port), args.cert, args.backlog)
+    ProtocolSniffer.size = args.sniff_size
+    ProtocolSniffer.timeout = args.sniff_timeout
+
+    Proxy.use_splice = not args.no_splice
+    Connection.read_size = args.buffer_size
+    Proxy.high_water = args.high_water
+    Proxy.low_water = args.low_water
+
+    AdmissionControl.max_connections = args.max_connections
+    AdmissionControl.max_per_ip = args.max_connections_per_ip
+    AdmissionControl.rate = args.accept_rate
+    AdmissionControl.burst = args.accept_burst
+
+    BandwidthShaper.upload_rate = args.upload_rate
+    BandwidthShaper.download_rate = args.download_rate
+    BandwidthShaper.ip_upload_rate = args.ip_upload_rate
+    BandwidthShaper.ip_download_rate = args.ip_download_rate
+
+    SessionTimers.detect_timeout = args.detect_timeout
+    SessionTimers.idle_timeout = args.idle_timeout
+    SessionTimers.max_age = args.max_session_age
+
+    HandshakePool.workers = args.handshake_workers
+    HandshakePool.queue_size = args.handshake_queue
+    HandshakePool.timeout = args.handshake_timeout
+    HandshakePool.overflow = args.handshake_overflow
+
+    ServerGroup.drain_timeout = AsyncServerGroup.drain_timeout = args.drain_timeout
+
+    if args.engine == 'asyncio':
+        http_class, https_class = AsyncHTTP, AsyncHTTPS
     else:
-        server = HTTP((args.host, args.port), args.backlog)
+        http_class, https_class = HTTP, HTTPS
+
+    try:
+        specs = [
+            parse_listen(value, args.host)
+            for value in args.listen or ['%s:%d' % ('https' if args.https else 'http', args.port)]
+        ]
+    except ValueError as e:
+        parser.error(str(e))
+
+    if any(mode == 'https' for mode, _ in specs) and not os.path.exists(args.cert):
+        parser.error('Certificate %s not found' % args.cert)
+
+    if args.buffer_size < 1:
+        parser.error('Buffer size must be greater than 0')
+
+    if args.sniff_size < 1:
+        parser.error('Sniff size must be greater than 0')
+
+    if not 0 <= args.low_water < args.high_water:
+        parser.error('Low water must be between 0 and high water')
+
+    if args.handshake_workers < 1 or args.handshake_queue < 1:
+        parser.error('Handshake workers and queue must be greater than 0')
+
+    if min(args.upload_rate, args.download_rate, args.ip_upload_rate, args.ip_download_rate) < 0:
+        parser.error('Rates must not be negative')
+
+    if args.workers < 1:
+        parser.error('Workers must be greater than 0')
+
+    if args.workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        parser.error('SO_REUSEPORT is not supported on this platform')
+
+    group_class = AsyncServerGroup if args.engine == 'asyncio' else ServerGroup
+
+    def create_server(
+        mode: str,
+        addr: Tuple[str, int],
+        sock: Optional[socket.socket] = None,
+    ) -> Union[TCP, AsyncTCP]:
+        if mode == 'https':
+            return https_class(addr, args.cert, args.backlog, sock=sock)
+        return http_class(addr, args.backlog, sock=sock)
+
+    def create_group(selected: List[Listener]) -> Union[ServerGroup, AsyncServerGroup]:
+        group = group_class()
+        for mode, addr, sock in selected:
+            group.add(listener_name(mode, addr), create_server(mode, addr, sock))
+        return group
 
     logging.basicConfig(
         level=getattr(logging, args.log.upper()),
@@ -448,7 +2873,104 @@ def main():
         datefmt='%H:%M:%S',
     )
 
-    server.run()
+    nofile = raise_nofile_limit()
+    logger.info(
+        'Limite de arquivos abertos: %d (até %d conexões por processo)'
+        % (nofile, ADMISSION.limit)
+    )
+
+    metrics_address = args.metrics_socket or (
+        (args.metrics_host, args.metrics_port) if args.metrics_port is not None else None
+    )
+
+    received: List[Listener] = []
+    if args.takeover:
+        try:
+            received = takeover(args.takeover)
+        except OSError as e:
+            logger.warning('Não foi possível assumir %s: %s' % (args.takeover, e))
+
+    listeners = ListenerSet(args.workers, args.backlog)
+    adopted: List[socket.socket] = []
+
+    for mode, addr in specs:
+        sockets = [sock for _, (_, port), sock in received if port == addr[1]]
+        adopted.extend(sockets)
+        try:
+            listeners.add(mode, addr, sockets)
+        except ValueError as e:
+            parser.error(str(e))
+
+    for _, (_, port), sock in received:
+        if sock not in adopted:
+            logger.info('Porta %d liberada para o processo anterior' % port)
+            sock.close()
+
+    control = ControlServer(args.control) if args.control else None
+
+    runner: Union[WorkerPool, ServerGroup, AsyncServerGroup]
+    if listeners.copies > 1:
+        pool = WorkerPool(create_group, listeners.copies, listeners=listeners)
+        runner, reload, drain = pool, pool.reload, pool.drain
+        if metrics_address:
+            pool.serve_metrics(metrics_address)
+    else:
+        group = create_group(listeners.select(0))
+        runner, reload, drain = group, group.reload, group.stop
+        if metrics_address:
+            MetricsServer(metrics_address, lambda: [REGISTRY.snapshot()]).start()
+
+    if control is not None:
+
+        def handle_reload(conn: socket.socket, _: List[str]) -> None:
+            reload()
+            conn.sendall(b'OK\n')
+
+        def handle_takeover(conn: socket.socket, _: List[str]) -> None:
+            specs, fds = listeners.export()
+            send_fds(conn, b'OK %s\n' % json.dumps(specs).encode(), fds)
+            logger.info('Sockets de escuta transferidos, drenando conexões...')
+            control.close()
+            drain()
+
+        def handle_listen(conn: socket.socket, values: List[str]) -> None:
+            for value in values:
+                mode, addr = parse_listen(value, args.host)
+                if mode == 'https' and not os.path.exists(args.cert):
+                    raise ValueError('Certificate %s not found' % args.cert)
+
+                name = listeners.add(mode, addr)
+                if runner is group:
+                    group.add(name, create_server(*listeners.get(name)))
+                logger.info('Listener %s adicionado' % name)
+
+            if runner is pool:
+                pool.rotate()
+            conn.sendall(b'OK\n')
+
+        def handle_unlisten(conn: socket.socket, values: List[str]) -> None:
+            for value in values:
+                name = listener_name(*parse_listen(value, args.host))
+                if runner is group:
+                    group.remove(name)
+                listeners.remove(name)
+                logger.info('Listener %s removido' % name)
+
+            if runner is pool:
+                pool.rotate()
+            conn.sendall(b'OK\n')
+
+        def handle_listeners(conn: socket.socket, _: List[str]) -> None:
+            conn.sendall(b'OK %s\n' % ' '.join(listeners.names).encode())
+
+        control.register('reload', handle_reload)
+        control.register('takeover', handle_takeover)
+        control.register('listen', handle_listen)
+        control.register('unlisten', handle_unlisten)
+        control.register('listeners', handle_listeners)
+        control.start()
+
+    runner.run()
 
 
 if __name__ == '__main__':
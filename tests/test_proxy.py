@@ -1,4 +1,52 @@
-from scripts.socks import WebsocketParseResponse, WS_DEFAULT_RESPONSE
+import asyncio
+import os
+import socket
+import ssl
+import threading
+import time
+
+import pytest
+
+from scripts import CERT_PATH
+
+from scripts.socks import (
+    AdmissionControl,
+    AsyncProxy,
+    BandwidthShaper,
+    Client,
+    Connection,
+    ConnectionTypeFactory,
+    ControlServer,
+    Counter,
+    Gauge,
+    HTTP,
+    HANDSHAKE_QUEUE,
+    HandshakePool,
+    Histogram,
+    MetricsRegistry,
+    MetricsServer,
+    ProtocolTable,
+    Proxy,
+    REGISTRY,
+    REJECTED_CONNECTIONS,
+    Remotes,
+    REMOTES_ADDRESS,
+    SHAPED_BYTES,
+    Server,
+    SessionTimers,
+    SpliceRelay,
+    TCP,
+    THROTTLED_CONNECTIONS,
+    TLSContext,
+    TokenBucket,
+    TimerWheel,
+    WebsocketParseResponse,
+    WS_DEFAULT_RESPONSE,
+    WorkerPool,
+    create_listener,
+    send_fds,
+    takeover,
+)
 
 
 def test_websocket_parse_response():
@@ -17,3 +65,556 @@ def test_error_websocket_parse_response():
     status = parser.parse(body)
 
     assert status != WS_DEFAULT_RESPONSE
+
+
+def test_async_proxy_websocket_upgrade():
+    async def scenario():
+        server = await asyncio.start_server(
+            lambda reader, writer: AsyncProxy(reader, writer).run(), '127.0.0.1', 0
+        )
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(b'GET / HTTP/1.1\r\nUpgrade: websocket\r\n\r\n')
+        response = await reader.read(1024)
+        writer.close()
+        server.close()
+        return response
+
+    assert asyncio.run(scenario()) == WS_DEFAULT_RESPONSE
+
+
+def test_async_proxy_relays_ssh(monkeypatch):
+    async def echo(reader, writer):
+        writer.write(await reader.read(1024))
+        await writer.drain()
+        writer.close()
+
+    async def scenario():
+        backend = await asyncio.start_server(echo, '127.0.0.1', 0)
+        monkeypatch.setitem(REMOTES_ADDRESS, 'ssh', backend.sockets[0].getsockname())
+
+        server = await asyncio.start_server(
+            lambda reader, writer: AsyncProxy(reader, writer).run(), '127.0.0.1', 0
+        )
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(b'SSH-2.0-OpenSSH_8.9\r\n')
+        response = await reader.read(1024)
+        writer.close()
+        server.close()
+        backend.close()
+        return response
+
+    assert asyncio.run(scenario()) == b'SSH-2.0-OpenSSH_8.9\r\n'
+
+
+def test_tcp_reuse_port_allows_shared_listeners():
+    first = TCP(('127.0.0.1', 0), reuse_port=True)
+    first.listen()
+    port = first._TCP__sock.getsockname()[1]
+
+    second = TCP(('127.0.0.1', port), reuse_port=True)
+    second.listen()
+
+    assert second._TCP__sock.getsockname()[1] == port
+
+    first._TCP__sock.close()
+    second._TCP__sock.close()
+
+
+def test_worker_pool_restarts_dead_workers(tmp_path):
+    marker = tmp_path / 'workers'
+
+    class ShortLivedWorker:
+        def run(self):
+            with open(str(marker), 'a') as f:
+                f.write('%d\n' % os.getpid())
+
+    pool = WorkerPool(ShortLivedWorker, 1, restart_delay=0.01)
+    thread = threading.Thread(target=pool.run)
+    thread.start()
+
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        if marker.exists() and len(marker.read_text().split()) >= 3:
+            break
+        time.sleep(0.01)
+
+    pool.stop()
+    thread.join(5)
+
+    assert len(set(marker.read_text().split())) >= 3
+    assert not pool.pids
+
+
+@pytest.mark.skipif(not hasattr(os, 'splice'), reason='os.splice is not available')
+def test_splice_relay_moves_data_both_ways():
+    client, client_peer = socket.socketpair()
+    server, server_peer = socket.socketpair()
+
+    relay = SpliceRelay(client_peer, server_peer)
+    thread = threading.Thread(target=relay.relay)
+    thread.start()
+
+    client.sendall(b'SSH-2.0-Client\r\n')
+    assert server.recv(1024) == b'SSH-2.0-Client\r\n'
+
+    payload = os.urandom(256 * 1024)
+    server.sendall(payload)
+    received = b''
+    while len(received) < len(payload):
+        received += client.recv(65536)
+
+    server.close()
+    thread.join(5)
+
+    assert received == payload
+    assert relay.transferred == (16, len(payload))
+
+    for sock in (client, client_peer, server_peer):
+        sock.close()
+
+
+def test_connection_flush_keeps_order_across_partial_sends():
+    writer, reader = socket.socketpair()
+    writer.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    writer.setblocking(False)
+
+    connection = Connection(writer, ('127.0.0.1', 0))
+    chunks = [os.urandom(size) for size in (100, 300000, 7)]
+    for chunk in chunks:
+        connection.queue(chunk)
+
+    assert connection.pending == sum(len(chunk) for chunk in chunks)
+
+    received = b''
+    while connection.pending:
+        try:
+            connection.flush()
+        except BlockingIOError:
+            pass
+        received += reader.recv(1 << 20)
+
+    assert received == b''.join(chunks)
+    assert connection.buffer == b''
+
+    writer.close()
+    reader.close()
+
+
+def test_proxy_pauses_reader_above_high_water(monkeypatch):
+    monkeypatch.setattr(Proxy, 'high_water', 1024)
+    monkeypatch.setattr(Proxy, 'low_water', 256)
+
+    client_sock, client_peer = socket.socketpair()
+    server_sock, server_peer = socket.socketpair()
+    proxy = Proxy(Client(client_sock, ('127.0.0.1', 1)), Server(server_sock, ('127.0.0.1', 2)))
+
+    throttled = THROTTLED_CONNECTIONS.value()
+    proxy.client.queue(b'x' * 1024)
+    rlist, _, _ = proxy._get_waitable_lists()
+
+    assert server_sock not in rlist
+    assert client_sock in rlist
+    assert THROTTLED_CONNECTIONS.value() == throttled + 1
+
+    proxy.client.buffer = b'x' * 512
+    rlist, _, _ = proxy._get_waitable_lists()
+    assert server_sock not in rlist
+
+    proxy.client.buffer = b'x' * 256
+    rlist, _, _ = proxy._get_waitable_lists()
+    assert server_sock in rlist
+    assert THROTTLED_CONNECTIONS.value() == throttled
+
+    for sock in (client_sock, client_peer, server_sock, server_peer):
+        sock.close()
+
+
+def test_tls_context_resumes_sessions_and_reloads(tmp_path):
+    cert = tmp_path / 'cert.pem'
+    cert.write_bytes(open(CERT_PATH, 'rb').read())
+    tls = TLSContext(str(cert))
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(5)
+
+    def serve(count):
+        for _ in range(count):
+            conn, _ = listener.accept()
+            with tls.wrap(conn) as tls_conn:
+                tls_conn.sendall(b'ok')
+                tls_conn.recv(1)
+
+    thread = threading.Thread(target=serve, args=(2,))
+    thread.start()
+
+    client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    client_context.check_hostname = False
+    client_context.verify_mode = ssl.CERT_NONE
+
+    session = None
+    reused = []
+    for _ in range(2):
+        sock = socket.create_connection(listener.getsockname())
+        with client_context.wrap_socket(sock, session=session) as tls_sock:
+            tls_sock.recv(2)
+            session = tls_sock.session
+            reused.append(tls_sock.session_reused)
+
+    thread.join(5)
+    listener.close()
+
+    assert reused == [False, True]
+    assert tls.reload()
+
+    cert.write_text('invalid')
+    assert not tls.reload()
+
+
+def test_handshake_pool_overflow_policies(monkeypatch):
+    monkeypatch.setattr(HandshakePool, 'queue_size', 1)
+    handled = []
+    pairs = [socket.socketpair() for _ in range(3)]
+
+    monkeypatch.setattr(HandshakePool, 'overflow', 'reject')
+    pool = HandshakePool(lambda conn, addr: handled.append(addr))
+    assert pool.submit(pairs[0][0], ('127.0.0.1', 1))
+    assert not pool.submit(pairs[1][0], ('127.0.0.1', 2))
+    assert pairs[1][0].fileno() == -1
+
+    monkeypatch.setattr(HandshakePool, 'overflow', 'drop-oldest')
+    assert pool.submit(pairs[2][0], ('127.0.0.1', 3))
+    assert pairs[0][0].fileno() == -1
+    assert HANDSHAKE_QUEUE.value() == 1
+
+    monkeypatch.setattr(HandshakePool, 'workers', 1)
+    pool.start()
+
+    deadline = time.time() + 5
+    while not handled and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert handled == [('127.0.0.1', 3)]
+    assert HANDSHAKE_QUEUE.value() == 0
+
+    for first, second in pairs:
+        first.close()
+        second.close()
+
+
+def test_async_proxy_routes_payload_and_ssh_banner_in_one_segment(monkeypatch):
+    async def echo(reader, writer):
+        writer.write(await reader.read(1024))
+        await writer.drain()
+        writer.close()
+
+    async def scenario():
+        backend = await asyncio.start_server(echo, '127.0.0.1', 0)
+        monkeypatch.setitem(REMOTES_ADDRESS, 'ssh', backend.sockets[0].getsockname())
+
+        server = await asyncio.start_server(
+            lambda reader, writer: AsyncProxy(reader, writer).run(), '127.0.0.1', 0
+        )
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(b'GET / HTTP/1.1\r\nUpgrade: websocket\r\n\r\nSSH-2.0-Client\r\n')
+
+        expected = WS_DEFAULT_RESPONSE + b'SSH-2.0-Client\r\n'
+        response = await reader.readexactly(len(expected))
+        writer.close()
+        server.close()
+        backend.close()
+        return response
+
+    assert asyncio.run(scenario()) == WS_DEFAULT_RESPONSE + b'SSH-2.0-Client\r\n'
+
+
+def test_protocol_table_prefers_longest_prefix_and_waits_on_ambiguity():
+    table = ConnectionTypeFactory.table
+
+    assert table.match(b'SSH-2.0-OpenSSH')[0].name == 'SSH'
+    assert table.match(b'\x0068\x38')[0].name == 'OpenVPN'
+    assert table.match(b'\x00\x01')[0].name == 'V2Ray'
+
+    connection_type, complete = table.match(b'\x00')
+    assert connection_type.name == 'V2Ray'
+    assert not complete
+
+    assert table.match(b'SS') == (None, False)
+    assert table.match(b'GET / HTTP/1.1\r\n') == (None, True)
+
+
+def test_protocol_table_load(tmp_path):
+    path = tmp_path / 'protocols'
+    path.write_text('# nome destino prefixo\nSSH ssh SSH-\nTrojan v2ray \\x05\\x01\n')
+
+    table = ProtocolTable.load(str(path))
+
+    assert [t.name for t in table.types] == ['SSH', 'Trojan']
+    assert table.match(b'\x05\x01\x00')[0].address == REMOTES_ADDRESS['v2ray']
+
+    path.write_text('SSH unknown SSH-\n')
+    with pytest.raises(ValueError):
+        ProtocolTable.load(str(path))
+
+
+def test_proxy_routes_payload_and_ssh_banner_in_one_segment(monkeypatch):
+    backend = socket.socket()
+    backend.bind(('127.0.0.1', 0))
+    backend.listen(1)
+    monkeypatch.setitem(REMOTES_ADDRESS, 'ssh', backend.getsockname())
+
+    server = HTTP(('127.0.0.1', 0))
+    server.listen()
+    listener = server._TCP__sock
+
+    client = socket.create_connection(listener.getsockname())
+    conn, addr = listener.accept()
+    server.handle(conn, addr)
+
+    client.sendall(b'GET / HTTP/1.1\r\nUpgrade: websocket\r\n\r\nSSH-2.0-Client\r\n')
+    backend_conn, _ = backend.accept()
+    backend_conn.settimeout(5)
+
+    assert client.recv(1024) == WS_DEFAULT_RESPONSE
+    assert backend_conn.recv(1024) == b'SSH-2.0-Client\r\n'
+
+    backend_conn.sendall(b'SSH-2.0-Server\r\n')
+    assert client.recv(1024) == b'SSH-2.0-Server\r\n'
+
+    for sock in (client, backend_conn, backend, listener):
+        sock.close()
+
+
+def test_metrics_are_aggregated_across_threads_and_rendered():
+    registry = MetricsRegistry()
+    counter = registry.register(Counter('test_bytes', 'Bytes', ('direction',)))
+    gauge = registry.register(Gauge('test_active', 'Active'))
+    histogram = registry.register(Histogram('test_seconds', 'Seconds'))
+
+    def work():
+        for _ in range(1000):
+            counter.inc(2, ('in',))
+        gauge.inc()
+        histogram.observe(0.2)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gauge.dec(2)
+
+    assert counter.value(('in',)) == 8000
+    assert gauge.value() == 2
+    assert histogram.count() == 4
+
+    text = registry.render([registry.snapshot(), registry.snapshot()])
+
+    assert 'test_bytes_total{direction="in"} 16000' in text
+    assert 'test_active 4' in text
+    assert 'test_seconds_bucket{le="0.25"} 8' in text
+    assert 'test_seconds_count 8' in text
+    assert text.endswith('# EOF\n')
+
+
+def test_metrics_server_serves_openmetrics_over_unix_socket(tmp_path):
+    path = str(tmp_path / 'metrics.sock')
+    server = MetricsServer(path, lambda: [REGISTRY.snapshot()])
+    server.start()
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    client.sendall(b'GET /metrics HTTP/1.1\r\n\r\n')
+
+    response = b''
+    while True:
+        data = client.recv(65536)
+        if not data:
+            break
+        response += data
+    client.close()
+    server.close()
+
+    assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert b'# TYPE socks_active_connections gauge' in response
+    assert response.endswith(b'# EOF\n')
+
+
+def test_timer_wheel_fires_in_batches_and_cancels(monkeypatch):
+    monkeypatch.setattr(TimerWheel, 'tick', 0.01)
+    wheel = TimerWheel()
+    fired = []
+
+    for delay in (0.02, 0.02, 0.05):
+        wheel.schedule(delay, lambda delay=delay: fired.append(delay))
+    cancelled = wheel.schedule(0.03, lambda: fired.append('cancelled'))
+    wheel.cancel(cancelled)
+
+    deadline = time.time() + 5
+    while len(fired) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+
+    assert fired == [0.02, 0.02, 0.05]
+
+
+def test_proxy_closes_clients_that_never_pick_a_backend(monkeypatch):
+    monkeypatch.setattr(TimerWheel, 'tick', 0.05)
+    monkeypatch.setattr(SessionTimers, 'detect_timeout', 0.1)
+
+    server = HTTP(('127.0.0.1', 0))
+    server.listen()
+    listener = server._TCP__sock
+
+    client = socket.create_connection(listener.getsockname())
+    client.settimeout(5)
+    conn, addr = listener.accept()
+    server.handle(conn, addr)
+
+    start = time.time()
+    assert client.recv(1024) == b''
+    assert time.time() - start < 2
+
+    client.close()
+    listener.close()
+
+
+def test_admission_control_rejects_by_reason_and_releases(monkeypatch):
+    monkeypatch.setattr(AdmissionControl, 'max_connections', 3)
+    monkeypatch.setattr(AdmissionControl, 'max_per_ip', 2)
+    admission = AdmissionControl()
+    before = {
+        reason: REJECTED_CONNECTIONS.value((reason,)) for reason in ('global', 'ip_limit')
+    }
+
+    assert admission.admit('10.0.0.1')
+    assert admission.admit('10.0.0.1')
+    assert not admission.admit('10.0.0.1')
+    assert admission.admit('10.0.0.2')
+    assert not admission.admit('10.0.0.3')
+    assert admission.active == 3
+
+    admission.release('10.0.0.1')
+    admission.release('10.0.0.9')
+    assert admission.active == 2
+    assert admission.admit('10.0.0.3')
+
+    assert REJECTED_CONNECTIONS.value(('ip_limit',)) == before['ip_limit'] + 1
+    assert REJECTED_CONNECTIONS.value(('global',)) == before['global'] + 1
+
+
+def test_admission_control_rate_limits_new_connections_per_ip(monkeypatch):
+    monkeypatch.setattr(AdmissionControl, 'max_connections', 100)
+    monkeypatch.setattr(AdmissionControl, 'rate', 10.0)
+    monkeypatch.setattr(AdmissionControl, 'burst', 2)
+    admission = AdmissionControl()
+
+    assert admission.admit('10.0.0.1')
+    assert admission.admit('10.0.0.1')
+    assert not admission.admit('10.0.0.1')
+    assert admission.admit('10.0.0.2')
+
+    time.sleep(0.15)
+    assert admission.admit('10.0.0.1')
+
+    bucket = TokenBucket(rate=1000, burst=5)
+    assert all(bucket.consume() for _ in range(5))
+    assert not bucket.consume()
+
+
+@pytest.mark.parametrize('use_splice', [False, True])
+def test_proxy_shapes_download_rate(monkeypatch, use_splice):
+    monkeypatch.setattr(Proxy, 'use_splice', use_splice)
+    monkeypatch.setattr(BandwidthShaper, 'download_rate', 50000)
+
+    client_sock, client_peer = socket.socketpair()
+    server_sock, server_peer = socket.socketpair()
+    proxy = Proxy(Client(client_sock, ('127.0.0.1', 1)), Server(server_sock, ('127.0.0.1', 2)))
+    shaped = SHAPED_BYTES.value(('out',))
+
+    start = time.monotonic()
+    proxy.start()
+    server_peer.sendall(b'x' * 100000)
+
+    received = 0
+    client_peer.settimeout(5)
+    while received < 100000:
+        received += len(client_peer.recv(65536))
+    elapsed = time.monotonic() - start
+
+    client_peer.close()
+    server_peer.close()
+    proxy.join(5)
+
+    assert 0.8 < elapsed < 3
+    assert SHAPED_BYTES.value(('out',)) == shaped + 100000
+
+
+def test_bandwidth_shaper_shares_buckets_per_ip(monkeypatch):
+    monkeypatch.setattr(BandwidthShaper, 'ip_upload_rate', 1000)
+    shaper = BandwidthShaper()
+
+    first, _ = shaper.acquire('10.0.0.1')
+    second, download = shaper.acquire('10.0.0.1')
+    other, _ = shaper.acquire('10.0.0.2')
+
+    assert download is None
+    assert first.allowance(4096) == 1000
+
+    first.charge(1000)
+    assert second.allowance(4096) == 0
+    assert second.delay() > 0
+    assert other.allowance(4096) == 1000
+
+    shaper.release('10.0.0.1')
+    shaper.release('10.0.0.1')
+    third, _ = shaper.acquire('10.0.0.1')
+    assert third.allowance(4096) == 1000
+
+
+def test_remotes_reload_updates_backends_for_new_sessions(tmp_path, monkeypatch):
+    remotes = tmp_path / 'remotes'
+    remotes.write_text('ssh 2222  # moved\nmtproxy 10.0.0.5:443\n')
+    monkeypatch.setattr(Remotes, 'path', str(remotes))
+    monkeypatch.setattr(Remotes, 'host', '127.0.0.1')
+    monkeypatch.setitem(REMOTES_ADDRESS, 'ssh', ('127.0.0.1', 22))
+    monkeypatch.setitem(REMOTES_ADDRESS, 'mtproxy', ('127.0.0.1', 0))
+
+    ssh_type = ConnectionTypeFactory.get_type(b'SSH-2.0-OpenSSH_8.9\r\n')
+    assert Remotes.reload()
+
+    assert ssh_type.address == ('127.0.0.1', 2222)
+    assert REMOTES_ADDRESS['mtproxy'] == ('10.0.0.5', 443)
+
+    remotes.write_text('ssh\n')
+    assert not Remotes.reload()
+    assert REMOTES_ADDRESS['ssh'] == ('127.0.0.1', 2222)
+
+
+def test_takeover_receives_listening_socket_and_drains_old_server(tmp_path):
+    listener = create_listener(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    old = HTTP(('127.0.0.1', port), sock=listener)
+    thread = threading.Thread(target=old.run)
+    thread.start()
+
+    def handle_takeover(conn, args):
+        send_fds(conn, b'OK 1\n', [listener.fileno()])
+        old.stop()
+
+    control = ControlServer(str(tmp_path / 'control.sock'))
+    control.register('takeover', handle_takeover)
+    control.start()
+
+    adopted = takeover(control.path, ('127.0.0.1', port))
+    thread.join(5)
+    control.close()
+
+    assert not thread.is_alive()
+    assert [sock.getsockname() for sock in adopted] == [('127.0.0.1', port)]
+
+    client = socket.create_connection(('127.0.0.1', port))
+    conn, _ = adopted[0].accept()
+    conn.close()
+    client.close()
+    adopted[0].close()